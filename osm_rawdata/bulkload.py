@@ -0,0 +1,831 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""Bulk loading of features into postgres using a binary COPY."""
+
+import hashlib
+import json
+import logging
+import struct
+import time
+from io import BytesIO
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine.base import Connection
+from sqlalchemy.exc import IntegrityError, ProgrammingError
+
+from osm_rawdata.grid import GRID_COLUMNS, GRID_ROWS, GRID_SIZE
+
+# Instantiate logger
+log = logging.getLogger("osm-rawdata")
+
+# The binary COPY header is the signature, a flags field, and the
+# length of the (empty) header extension.
+COPY_HEADER = b"PGCOPY\n\377\r\n\0" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+
+# The postgres type of each column the importers can write.
+COLUMNS = {
+    "id": "bigint",
+    "osm_id": "bigint",
+    "uid": "int",
+    "user": "text",
+    "version": "int",
+    "changeset": "int",
+    "tags": "jsonb",
+    "geom": "geometry",
+    "source_id": "text",
+    "hash": "text",
+    "grid": "int",
+}
+
+# The intersection over union with an OSM building above which an
+# imported building is a duplicate of it
+DEDUP_IOU = 0.5
+
+# The number of IDs each nextval() of the import_ids sequence reserves
+ID_BLOCK = 10000
+
+# Whether each table is partitioned, the partitioned tables whose new
+# partitions are unlogged, and the partitions each process knows exist
+partitioned = dict()
+unlogged = set()
+partitions = set()
+
+# The flag set in the geometry type when an EWKB has an SRID
+WKB_SRID = 0x20000000
+
+# The WKB geometry type codes the importers handle
+WKB_TYPES = {
+    1: "Point",
+    2: "LineString",
+    3: "Polygon",
+    4: "MultiPoint",
+    5: "MultiLineString",
+    6: "MultiPolygon",
+    7: "GeometryCollection",
+}
+
+
+def wkbType(data: bytes) -> str:
+    """Get the geometry type from a WKB or EWKB buffer without decoding it.
+
+    Args:
+        data (bytes): The WKB geometry
+
+    Returns:
+        (str): The geometry type, for example Polygon
+    """
+    order = "<" if data[0] == 1 else ">"
+    (kind,) = struct.unpack(f"{order}I", data[1:5])
+    # Strip the EWKB flags, and the ISO offset for Z and M geometries
+    return WKB_TYPES.get((kind & 0x0FFFFFFF) % 1000)
+
+
+def toEwkb(
+    data: bytes,
+    srid: int = 4326,
+) -> bytes:
+    """Add an SRID to a WKB buffer, making it an EWKB.
+
+    The coordinates are copied as is, the geometry isn't decoded.
+
+    Args:
+        data (bytes): The WKB geometry
+        srid (int): The SRID to add
+
+    Returns:
+        (bytes): The EWKB geometry
+    """
+    order = "<" if data[0] == 1 else ">"
+    (kind,) = struct.unpack(f"{order}I", data[1:5])
+    if kind & WKB_SRID:
+        return bytes(data)
+
+    return data[:1] + struct.pack(f"{order}II", kind | WKB_SRID, srid) + data[5:]
+
+
+def hilbertKeys(
+    x: np.ndarray,
+    y: np.ndarray,
+    order: int = 16,
+) -> np.ndarray:
+    """Get the position of points along a Hilbert curve covering the world.
+
+    Points that are close on the map are usually close on the curve,
+    so sorting by the key keeps nearby features together on disk.
+
+    Args:
+        x (ndarray): The longitudes
+        y (ndarray): The latitudes
+        order (int): The number of levels in the curve
+
+    Returns:
+        (ndarray): The position of each point along the curve
+    """
+    side = 1 << order
+    # Scale the coordinates to the integer grid of the curve
+    hx = np.clip(((np.asarray(x) + 180.0) / 360.0 * side).astype(np.int64), 0, side - 1)
+    hy = np.clip(((np.asarray(y) + 90.0) / 180.0 * side).astype(np.int64), 0, side - 1)
+    keys = np.zeros(hx.shape, dtype=np.int64)
+    step = side >> 1
+    while step > 0:
+        rx = (hx & step) > 0
+        ry = (hy & step) > 0
+        keys += step * step * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        hx = np.where(flip, side - 1 - hx, hx)
+        hy = np.where(flip, side - 1 - hy, hy)
+        hx, hy = np.where(~ry, hy, hx), np.where(~ry, hx, hy)
+        step >>= 1
+
+    return keys
+
+
+def gridCells(
+    x: np.ndarray,
+    y: np.ndarray,
+) -> list:
+    """Get the grid cell of each point, like gridCell() for arrays.
+
+    Args:
+        x (ndarray): The longitudes
+        y (ndarray): The latitudes
+
+    Returns:
+        (list): The grid cell of each point, None if the point isn't
+            finite, like the centre of an empty geometry
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x = np.where(finite, x, 0.0)
+    y = np.where(finite, y, 0.0)
+    column = np.clip(np.floor((x + 180.0) / GRID_SIZE), 0, GRID_COLUMNS - 1)
+    row = np.clip(np.floor((y + 90.0) / GRID_SIZE), 0, GRID_ROWS - 1)
+    cells = (row * GRID_COLUMNS + column).astype(np.int64)
+
+    # The rows without a cell go in the default partition
+    return [int(cell) if ok else None for cell, ok in zip(cells, finite, strict=True)]
+
+
+def createPartitions(
+    db: Connection,
+    table: str,
+    cells: list,
+):
+    """Create the partitions for grid cells that don't have one yet.
+
+    This only does anything if the table has been partitioned. Creating
+    a partition locks the whole table, so each one is committed in its
+    own transaction, and this must be called before the rows are
+    written, while the connection has no transaction open.
+
+    Args:
+        db (Connection): A database connection
+        table (str): The partitioned table
+        cells (list): The grid cells being written to
+    """
+    if table in partitioned and not partitioned[table]:
+        return
+    cells = [cell for cell in cells if (table, cell) not in partitions]
+    if table in partitioned and len(cells) == 0:
+        return
+    if db.in_transaction():
+        msg = f"The partitions of {table} can't be created inside a transaction"
+        log.error(msg)
+        raise ValueError(msg)
+
+    if table not in partitioned:
+        # New partitions are unlogged if the default one is, as when staging
+        sql = text(
+            "SELECT parent.relkind = 'p', fallback.relpersistence = 'u' "
+            "FROM pg_class AS parent "
+            "LEFT JOIN pg_partitioned_table ON partrelid = parent.oid "
+            "LEFT JOIN pg_class AS fallback ON fallback.oid = partdefid "
+            "WHERE parent.oid = to_regclass(:table)"
+        )
+        with db.begin():
+            kind = db.execute(sql, {"table": table}).first()
+        partitioned[table] = kind is not None and bool(kind[0])
+        if kind is not None and kind[1]:
+            unlogged.add(table)
+    if not partitioned[table]:
+        return
+    persistence = "UNLOGGED " if table in unlogged else ""
+    for cell in cells:
+        name = f"{table}_grid_{cell}"
+        partition = f"{name} PARTITION OF {table} FOR VALUES IN ({cell})"
+        sql = f"CREATE {persistence}TABLE IF NOT EXISTS {partition}"
+        try:
+            with db.begin():
+                db.execute(text(sql))
+        except (IntegrityError, ProgrammingError) as e:
+            # Another writer may have just created it
+            sql = text("SELECT to_regclass(:name)")
+            with db.begin():
+                exists = db.execute(sql, {"name": name}).scalar()
+            if exists is None:
+                log.error(f"Couldn't create {name}, run partitionTables() first: {e}")
+                raise
+        partitions.add((table, cell))
+
+
+def forgetPartitions():
+    """Forget which tables are partitioned, and the partitions they have.
+
+    This is used when the layout of the tables changes, so the writers
+    in this process check the database again.
+    """
+    partitioned.clear()
+    unlogged.clear()
+    partitions.clear()
+
+
+def contentHash(
+    geom: bytes,
+    tags: dict,
+) -> str:
+    """Get a hash of the content of a feature, to detect when it changes.
+
+    Args:
+        geom (bytes): The WKB geometry
+        tags (dict): The tags
+
+    Returns:
+        (str): The hash of the geometry and tags
+    """
+    content = hashlib.md5(bytes(geom))
+    content.update(json.dumps(tags, sort_keys=True, default=str).encode())
+
+    return content.hexdigest()
+
+
+def unitDone(
+    db: Connection,
+    unit: dict,
+) -> bool:
+    """Check whether a work unit is already in the import ledger.
+
+    Args:
+        db (Connection): A database connection
+        unit (dict): The source, unit, and checksum of the work unit
+
+    Returns:
+        (bool): Whether the work unit has already been imported
+    """
+    sql = text(
+        "SELECT checksum FROM import_ledger WHERE source = :source AND unit = :unit"
+    )
+    checksum = db.execute(sql, unit).scalar()
+    if checksum is None:
+        return False
+    if checksum != unit["checksum"]:
+        msg = f"{unit['source']} {unit['unit']} changed since it was imported"
+        log.error(msg)
+        raise ValueError(msg)
+
+    return True
+
+
+def importedUnits(
+    db: Connection,
+    source: str,
+) -> dict:
+    """Get the work units from a source that are already in the import ledger.
+
+    Args:
+        db (Connection): A database connection
+        source (str): The source of the work units
+
+    Returns:
+        (dict): The checksum of each imported work unit
+    """
+    sql = text("SELECT unit, checksum FROM import_ledger WHERE source = :source")
+    result = db.execute(sql, {"source": source}).all()
+    db.commit()
+
+    return {unit: checksum for unit, checksum in result}
+
+
+def encodeValue(
+    kind: str,
+    value,
+) -> bytes:
+    """Encode a single value in the postgres binary format.
+
+    Args:
+        kind (str): The postgres type, one of the values in COLUMNS
+        value: The value to encode
+
+    Returns:
+        (bytes): The field length followed by the encoded value
+    """
+    if value is None:
+        return struct.pack(">i", -1)
+    if kind == "bigint":
+        return struct.pack(">iq", 8, value)
+    if kind == "int":
+        return struct.pack(">ii", 4, value)
+    if kind == "float":
+        return struct.pack(">id", 8, value)
+    if kind == "jsonb":
+        # A JSONB value is a version byte followed by the JSON text
+        if isinstance(value, dict):
+            value = json.dumps(value, default=str)
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        data = b"\x01" + value
+    elif kind == "text":
+        data = value.encode("utf-8")
+    elif kind == "geometry":
+        # PostGIS accepts EWKB as the binary input for a geometry
+        data = bytes(value)
+    else:
+        raise ValueError(f"Unsupported column type {kind}")
+
+    return struct.pack(">i", len(data)) + data
+
+
+def encodeRows(
+    rows: list,
+    keys: list = None,
+) -> tuple:
+    """Encode rows as the data for a binary COPY.
+
+    Args:
+        rows (list): The column values for each row, all with the same columns
+        keys (list): The sort key for each row, the rows are sorted if given
+
+    Returns:
+        (tuple): The columns, and the encoded data
+    """
+    if keys is not None:
+        rows = [rows[index] for index in np.argsort(keys, kind="stable")]
+    columns = list(rows[0].keys())
+    kinds = [COLUMNS[column] for column in columns]
+    count = struct.pack(">h", len(columns))
+    data = BytesIO()
+    data.write(COPY_HEADER)
+    for row in rows:
+        data.write(count)
+        for column, kind in zip(columns, kinds, strict=True):
+            data.write(encodeValue(kind, row[column]))
+    data.write(COPY_TRAILER)
+
+    return columns, data.getvalue()
+
+
+def encodeTables(
+    tables: dict,
+    keys: dict = None,
+) -> dict:
+    """Encode the rows for each table as the data for a binary COPY.
+
+    This is the CPU heavy part of a load, so it can run in a different
+    process from the one writing the data.
+
+    Args:
+        tables (dict): The rows for each table
+        keys (dict): The sort keys for each table, the rows are sorted if given
+
+    Returns:
+        (dict): The columns, encoded data, and number of rows for each table
+    """
+    encoded = dict()
+    for table, rows in tables.items():
+        if len(rows) == 0:
+            continue
+        columns, data = encodeRows(rows, keys[table] if keys else None)
+        encoded[table] = (columns, data, len(rows))
+
+    return encoded
+
+
+def createIdSequence(
+    db: Connection,
+    block: int = ID_BLOCK,
+    sequence: str = "public.import_ids",
+):
+    """Create the sequence the feature IDs are allocated from.
+
+    This is done once before any workers start, as concurrent CREATE
+    SEQUENCE IF NOT EXISTS can fail when the sequence is new. The
+    sequence is in the public schema, so staged imports use it too.
+
+    Args:
+        db (Connection): A database connection
+        block (int): The number of IDs in each block, if the sequence is new
+        sequence (str): The name of the sequence
+    """
+    sql = f"CREATE SEQUENCE IF NOT EXISTS {sequence} INCREMENT BY {block}"
+    db.execute(text(sql))
+    db.commit()
+
+
+class IdAllocator(object):
+    """Class to allocate blocks of IDs for the imported features."""
+
+    def __init__(
+        self,
+        db: Connection,
+        sequence: str = "public.import_ids",
+    ):
+        """Reserve blocks of IDs for the importers from a database sequence.
+
+        The sequence increments by the block size, so each nextval()
+        reserves a whole block of IDs. Any number of processes can
+        allocate at the same time without getting the same IDs, and
+        there's no sequence call for each row. The sequence is created
+        by createIdSequence().
+
+        Args:
+            db (Connection): A database connection
+            sequence (str): The name of the sequence
+
+        Returns:
+            (IdAllocator): An instance of this class
+        """
+        self.db = db
+        self.sequence = sequence
+        # An existing sequence keeps the block size it was created with
+        sql = text(
+            "SELECT seqincrement FROM pg_sequence"
+            " WHERE seqrelid = to_regclass(:sequence)"
+        )
+        self.block = db.execute(sql, {"sequence": sequence}).scalar()
+        db.commit()
+        if self.block is None:
+            msg = f"The {sequence} sequence doesn't exist"
+            log.error(msg)
+            raise ValueError(msg)
+        self.next = 0
+        self.end = 0
+
+    def allocate(
+        self,
+        count: int,
+    ) -> list:
+        """Allocate IDs, reserving as many blocks as needed in one query.
+
+        Args:
+            count (int): The number of IDs
+
+        Returns:
+            (list): The ranges of IDs allocated
+        """
+        ranges = list()
+        if self.next < self.end and count > 0:
+            stop = min(self.end, self.next + count)
+            ranges.append(range(self.next, stop))
+            count -= stop - self.next
+            self.next = stop
+        if count <= 0:
+            return ranges
+
+        blocks = -(-count // self.block)
+        sql = text(
+            f"SELECT nextval('{self.sequence}') FROM generate_series(1, :blocks)"
+        )
+        starts = sorted(self.db.execute(sql, {"blocks": blocks}).scalars().all())
+        self.db.commit()
+        for start in starts:
+            stop = min(start + self.block, start + count)
+            # Blocks reserved one after the other are joined into one range
+            if len(ranges) > 0 and ranges[-1].stop == start:
+                ranges[-1] = range(ranges[-1].start, stop)
+            else:
+                ranges.append(range(start, stop))
+            count -= stop - start
+        self.next = stop
+        self.end = starts[-1] + self.block
+
+        return ranges
+
+
+class BulkLoader(object):
+    """Class to bulk load rows into the database with COPY."""
+
+    def __init__(
+        self,
+        db: Connection,
+        batch: int = 10000,
+        sort: bool = False,
+        merge: bool = False,
+        dedup: bool = False,
+        iou: float = DEDUP_IOU,
+    ):
+        """Buffer rows for each table and write them using a binary COPY.
+
+        In merge mode the rows must have a source_id and a hash. They are
+        copied into a temporary table, and then inserted with one
+        INSERT ... ON CONFLICT, which only updates the existing rows
+        whose hash has changed.
+
+        When removing duplicates, the polygons are also copied into a
+        temporary table, and only those that don't overlap an OSM
+        building by more than the intersection over union are inserted,
+        using one spatial join for the whole batch.
+
+        Args:
+            db (Connection): A database connection
+            batch (int): The number of rows to buffer before writing a table
+            sort (bool): Whether to sort the rows by their key before writing
+            merge (bool): Whether to merge the rows on their source_id
+            dedup (bool): Whether to skip polygons that duplicate OSM buildings
+            iou (float): The intersection over union of a duplicate
+
+        Returns:
+            (BulkLoader): An instance of this class
+        """
+        self.db = db
+        self.batch = batch
+        self.sort = sort
+        self.merge = merge
+        self.dedup = dedup
+        self.iou = iou
+        self.buffers = {
+            "nodes": list(),
+            "ways_line": list(),
+            "ways_poly": list(),
+        }
+        self.keys = {table: list() for table in self.buffers}
+        self.rows = 0
+        self.pending = 0
+        self.changed = 0
+        self.duplicates = 0
+        self.elapsed = 0.0
+
+    def add(
+        self,
+        table: str,
+        row: dict,
+        key: int = 0,
+    ):
+        """Add a row to the buffer for a table.
+
+        All the rows for a table must have the same columns, the geometry
+        is EWKB, and the tags are either a dict or serialized JSON.
+
+        Args:
+            table (str): The table to write the row into
+            row (dict): The column values for the row
+            key (int): The sort key, usually from hilbertKeys()
+        """
+        buffer = self.buffers[table]
+        buffer.append(row)
+        if self.sort:
+            self.keys[table].append(key)
+        if len(buffer) >= self.batch:
+            self.copy(table)
+
+    def copy(
+        self,
+        table: str,
+    ) -> int:
+        """Write the buffered rows for a table using COPY.
+
+        Args:
+            table (str): The table to write
+
+        Returns:
+            (int): The number of rows written
+        """
+        rows = self.buffers[table]
+        if len(rows) == 0:
+            return 0
+
+        keys = None
+        if self.sort:
+            keys = self.keys[table]
+            self.keys[table] = list()
+        columns, data = encodeRows(rows, keys)
+        self.buffers[table] = list()
+
+        return self.copyData(table, columns, data, len(rows))
+
+    def copyData(
+        self,
+        table: str,
+        columns: list,
+        data: bytes,
+        count: int,
+    ) -> int:
+        """Write data that is already encoded using COPY.
+
+        Args:
+            table (str): The table to write
+            columns (list): The columns in the data
+            data (bytes): The data from encodeRows()
+            count (int): The number of rows in the data
+
+        Returns:
+            (int): The number of rows written
+        """
+        start = time.perf_counter()
+        names = ", ".join([f'"{column}"' for column in columns])
+        target = table
+        dedup = self.dedup and table == "ways_poly"
+        if self.merge or dedup:
+            # The temporary table only lasts for the work unit's transaction
+            target = self._batchTable(table, columns)
+            sql = (
+                f"CREATE TEMP TABLE IF NOT EXISTS {target} ON COMMIT DROP"
+                f" AS SELECT {names} FROM {table} WITH NO DATA"
+            )
+            self.db.execute(text(sql))
+        if self.merge:
+            # COPY fills in the default in the order of the rows
+            self.db.execute(text("CREATE TEMP SEQUENCE IF NOT EXISTS batch_ordinal"))
+            sql = (
+                f"ALTER TABLE {target} ADD COLUMN IF NOT EXISTS ordinal bigint"
+                " DEFAULT nextval('batch_ordinal')"
+            )
+            self.db.execute(text(sql))
+        sql = f"COPY {target} ({names}) FROM STDIN (FORMAT binary)"
+        # The COPY goes straight to the DBAPI connection, so a transaction
+        # has to be started for commit() to know there's one to commit
+        if not self.db.in_transaction():
+            self.db.begin()
+        cursor = self.db.connection.cursor()
+        cursor.copy_expert(sql, BytesIO(data))
+        cursor.close()
+        written = count
+        if self.merge:
+            self.changed += self.upsert(table, columns)
+        elif dedup:
+            written = self.insert(table, columns)
+            self.duplicates += count - written
+
+        self.rows += written
+        self.pending += written
+        self.elapsed += time.perf_counter() - start
+
+        return written
+
+    def _batchTable(
+        self,
+        table: str,
+        columns: list,
+    ) -> str:
+        """Get the name of the temporary table for a batch of rows.
+
+        The name includes the columns, so batches for the same table
+        with different columns don't share a temporary table.
+
+        Args:
+            table (str): The table the batch is for
+            columns (list): The columns in the batch
+
+        Returns:
+            (str): The name of the temporary table
+        """
+        digest = hashlib.md5(",".join(columns).encode()).hexdigest()
+
+        return f"batch_{table}_{digest[:8]}"
+
+    def _duplicates(
+        self,
+        table: str,
+    ) -> str:
+        """Get the SQL to skip the rows in a batch that duplicate OSM buildings.
+
+        The features from OSM are the ones with a positive ID, and the
+        overlap is found using the GiST index on their geometry.
+
+        Args:
+            table (str): The table the batch is for
+
+        Returns:
+            (str): The WHERE clause for the batch, empty if nothing is skipped
+        """
+        if not self.dedup or table != "ways_poly":
+            return ""
+        overlap = "ST_Area(ST_Intersection(osm.geom, batch.geom))"
+        union = f"ST_Area(osm.geom) + ST_Area(batch.geom) - {overlap}"
+
+        return (
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} AS osm"
+            " WHERE osm.osm_id > 0 AND osm.tags ? 'building'"
+            " AND osm.geom && batch.geom AND ST_Intersects(osm.geom, batch.geom)"
+            f" AND {overlap} >= {float(self.iou)} * ({union}))"
+        )
+
+    def insert(
+        self,
+        table: str,
+        columns: list,
+    ) -> int:
+        """Move the rows in the temporary table for a table into it.
+
+        Args:
+            table (str): The table to insert into
+            columns (list): The columns in the temporary table
+
+        Returns:
+            (int): The number of rows inserted
+        """
+        names = ", ".join([f'"{column}"' for column in columns])
+        sql = (
+            f"WITH batch AS (DELETE FROM {self._batchTable(table, columns)}"
+            f" RETURNING {names}) INSERT INTO {table} ({names})"
+            f" SELECT {names} FROM batch {self._duplicates(table)}"
+        )
+        result = self.db.execute(text(sql))
+
+        return result.rowcount
+
+    def upsert(
+        self,
+        table: str,
+        columns: list,
+    ) -> int:
+        """Move the rows in the temporary table for a table into it.
+
+        New source IDs are inserted, and existing ones are only updated
+        if the hash has changed, so unchanged rows aren't written again.
+
+        Args:
+            table (str): The table to merge into
+            columns (list): The columns in the temporary table
+
+        Returns:
+            (int): The number of rows inserted or updated
+        """
+        names = ", ".join([f'"{column}"' for column in columns])
+        updates = ", ".join(
+            [
+                f'"{column}" = EXCLUDED."{column}"'
+                for column in columns
+                if column not in ("source_id", "osm_id")
+            ]
+        )
+        # An existing row keeps its ID, and a source ID can only be in a
+        # batch once, the last one copied wins
+        sql = (
+            f"WITH batch AS (DELETE FROM {self._batchTable(table, columns)}"
+            f" RETURNING ordinal, {names}) INSERT INTO {table} ({names})"
+            f" SELECT DISTINCT ON (source_id) {names} FROM batch"
+            f" {self._duplicates(table)} ORDER BY source_id, ordinal DESC"
+            f" ON CONFLICT (source_id) DO UPDATE SET {updates}"
+            f" WHERE {table}.hash IS DISTINCT FROM EXCLUDED.hash"
+        )
+        result = self.db.execute(text(sql))
+
+        return result.rowcount
+
+    def flush(
+        self,
+        unit: dict = None,
+    ) -> int:
+        """Write all the buffered rows and commit them.
+
+        Args:
+            unit (dict): The source, unit, and checksum of a work unit to
+                record in the import ledger in the same transaction
+
+        Returns:
+            (int): The total number of rows written by this loader
+        """
+        for table in self.buffers:
+            self.copy(table)
+        if unit is not None:
+            sql = text(
+                "INSERT INTO import_ledger (source, unit, rows, checksum)"
+                " VALUES (:source, :unit, :rows, :checksum)"
+            )
+            self.db.execute(sql, {**unit, "rows": self.pending})
+        self.db.commit()
+        self.pending = 0
+
+        return self.rows
+
+    def rate(self) -> float:
+        """The rows per second written by this loader.
+
+        Returns:
+            (float): The rows per second spent in COPY
+        """
+        if self.elapsed == 0:
+            return 0.0
+        return self.rows / self.elapsed
@@ -20,8 +20,18 @@
 # <info@hotosm.org>
 
 from geoalchemy2 import Geometry
-from sqlalchemy import BigInteger, Column, DateTime, SmallInteger, String
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Computed,
+    DateTime,
+    Float,
+    Integer,
+    SmallInteger,
+    String,
+    func,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -58,6 +68,7 @@ class Nodes(Base):
         id (BigInteger): The ID of the feature
         geom (Geometry): The geometry of the node
         tags (JSONB): The OSM tags
+        grid (Integer): The grid cell the node is in
     """
 
     __tablename__ = "nodes"
@@ -65,6 +76,7 @@ class Nodes(Base):
     # osm_id = Column(BigInteger, ForeignKey("base.osm_id"))
     tags = Column(JSONB)
     geom = Column(Geometry("POINT", srid=4326))
+    grid = Column(Integer)
 
 
 class Ways(Base):
@@ -72,14 +84,31 @@ class Ways(Base):
 
     Attributes:
        uid (BigInteger): The ID of the user.
+       osm_id (BigInteger): The ID of the feature, negative if it's not from OSM
+       refs (ARRAY): The IDs of the nodes in the way
        geom (Geometry): The geometry of the node
+       centroid (Geometry): The centroid, generated from the geometry
+       bbox (Geometry): The bounding box, generated from the geometry
+       area (Float): The area in square meters, generated from the geometry
+       grid (Integer): The grid cell the centre of the bounding box is in
     """
 
     __tablename__ = "ways_poly"
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     # osm_id = Column(BigInteger, ForeignKey("base.osm_id"))
+    osm_id = Column(BigInteger)
     tags = Column(JSONB)
+    refs = Column(ARRAY(BigInteger))
     geom = Column(Geometry("POLYGON", srid=4326))
+    centroid = Column(
+        Geometry("POINT", srid=4326), Computed("ST_Centroid(geom)", persisted=True)
+    )
+    bbox = Column(
+        Geometry(srid=4326, spatial_index=False),
+        Computed("ST_Envelope(geom)", persisted=True),
+    )
+    area = Column(Float, Computed("ST_Area(geom::geography)", persisted=True))
+    grid = Column(Integer)
 
 
 class Lines(Base):
@@ -87,11 +116,62 @@ class Lines(Base):
 
     Attributes:
        uid (BigInteger): The ID of the user.
+       osm_id (BigInteger): The ID of the feature, negative if it's not from OSM
+       refs (ARRAY): The IDs of the nodes in the way
        geom (Geometry): The geometry of the node
+       centroid (Geometry): The centroid, generated from the geometry
+       bbox (Geometry): The bounding box, generated from the geometry
+       length (Float): The length in meters, generated from the geometry
+       grid (Integer): The grid cell the centre of the bounding box is in
     """
 
     __tablename__ = "ways_line"
     # osm_id = Column(BigInteger, ForeignKey("base.osm_id"))
     id = Column(BigInteger, primary_key=True, unique=True)
+    osm_id = Column(BigInteger)
     tags = Column(JSONB)
+    refs = Column(ARRAY(BigInteger))
     geom = Column(Geometry("LINESTRING", srid=4326))
+    centroid = Column(
+        Geometry("POINT", srid=4326), Computed("ST_Centroid(geom)", persisted=True)
+    )
+    bbox = Column(
+        Geometry(srid=4326, spatial_index=False),
+        Computed("ST_Envelope(geom)", persisted=True),
+    )
+    length = Column(Float, Computed("ST_Length(geom::geography)", persisted=True))
+    grid = Column(Integer)
+
+
+class ImportLedger(Base):
+    """Class for a work unit committed by an import.
+
+    Attributes:
+        source (String): The file the work unit is from
+        unit (String): The row group or range of features in the file
+        rows (BigInteger): The number of rows written
+        checksum (String): The checksum of the work unit
+        timestamp (DateTime): When the work unit was committed
+    """
+
+    __tablename__ = "import_ledger"
+    source = Column(String, primary_key=True)
+    unit = Column(String, primary_key=True)
+    rows = Column(BigInteger)
+    checksum = Column(String)
+    timestamp = Column(DateTime, server_default=func.now())
+
+
+class ReplicationState(Base):
+    """Class for the last replication diff applied to the database.
+
+    Attributes:
+        source (String): The replication source, usually the diff directory
+        sequence (BigInteger): The sequence number of the last diff applied
+        timestamp (DateTime): The timestamp of the last diff applied
+    """
+
+    __tablename__ = "replication_state"
+    source = Column(String, primary_key=True)
+    sequence = Column(BigInteger)
+    timestamp = Column(DateTime)
@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""Generate a filtered osm2pgsql flex style from query config files."""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+from sys import argv
+
+# Find the other files for this project
+import osm_rawdata as rw
+from osm_rawdata.config import QueryConfig
+
+rootdir = rw.__path__[0]
+
+# Instantiate logger
+log = logging.getLogger(__name__)
+
+# The tables in the raw.lua style that can be filtered
+TABLES = ("nodes", "ways_line", "ways_poly", "relations")
+
+# The filtering added after the raw.lua style. Each object is matched
+# against the filters for its table, and only the tags to keep are
+# passed on to the raw.lua process functions.
+WRAPPER = """
+local function test(tags, term)
+    local value = tags[term[1]]
+    if value == nil then
+        return false
+    end
+    if #term[2] == 0 then
+        return true
+    end
+    for _, v in ipairs(term[2]) do
+        if value == v then
+            return true
+        end
+    end
+    return false
+end
+
+local function matches(tags, filter)
+    if filter.everything then
+        return true
+    end
+    for _, term in ipairs(filter.any) do
+        if test(tags, term) then
+            return true
+        end
+    end
+    if #filter.all == 0 then
+        return false
+    end
+    for _, term in ipairs(filter.all) do
+        if not test(tags, term) then
+            return false
+        end
+    end
+    return true
+end
+
+-- Returns true if the object matches a filter, and removes the tags
+-- none of the matching filters keep.
+local function filter_tags(tags, table_filters)
+    local keep = {}
+    local matched = false
+    local everything = false
+    for _, filter in ipairs(table_filters) do
+        if matches(tags, filter) then
+            matched = true
+            if next(filter.keep) == nil then
+                everything = true
+            end
+            for _, key in ipairs(filter.keep) do
+                keep[key] = true
+            end
+        end
+    end
+    if matched and not everything then
+        for key, _ in pairs(tags) do
+            if not keep[key] then
+                tags[key] = nil
+            end
+        end
+    end
+    return matched
+end
+
+local raw_process_node = osm2pgsql.process_node
+local raw_process_way = osm2pgsql.process_way
+local raw_process_relation = osm2pgsql.process_relation
+
+function osm2pgsql.process_node(object)
+    if filter_tags(object.tags, filters.nodes) then
+        raw_process_node(object)
+    end
+end
+
+function osm2pgsql.process_way(object)
+    local table_filters = filters.ways_line
+    if object.is_closed and #object.nodes > 3 then
+        table_filters = filters.ways_poly
+    end
+    if filter_tags(object.tags, table_filters) then
+        raw_process_way(object)
+    end
+end
+
+function osm2pgsql.process_relation(object)
+    -- raw.lua needs the type to build the multipolygon
+    local kind = object.tags.type
+    if filter_tags(object.tags, filters.relations) then
+        object.tags.type = kind
+        raw_process_relation(object)
+    end
+end
+"""
+
+
+def luaString(value: str) -> str:
+    """Quote a string for Lua.
+
+    Args:
+        value (str): The string to quote
+
+    Returns:
+        (str): The quoted string
+    """
+    value = str(value).replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n")
+    return f"'{value}'"
+
+
+class FlexStyle(object):
+    """Class to generate an osm2pgsql flex style."""
+
+    def __init__(
+        self,
+        configs: list = None,
+    ):
+        """Generate an osm2pgsql flex style that only imports what the configs use.
+
+        Args:
+            configs (list): The QueryConfigs, or the YAML or JSON files to parse
+
+        Returns:
+            (FlexStyle): An instance of this class
+        """
+        self.filters = {table: list() for table in TABLES}
+        for config in configs or list():
+            self.addConfig(config)
+
+    def addConfig(
+        self,
+        config,
+    ):
+        """Add the filters from a query config.
+
+        Args:
+            config (QueryConfig, str): A parsed config, or a YAML or JSON file
+        """
+        if isinstance(config, str):
+            path = Path(config)
+            qc = QueryConfig()
+            if path.suffix == ".json":
+                qc.parseJson(config)
+            elif path.suffix == ".yaml":
+                qc.parseYaml(config)
+            else:
+                log.error(f"{config} is an unsupported file format!")
+                raise ValueError(f"Invalid config {config}")
+            config = qc
+
+        data = config.config
+        keep = set(data.get("keep", list()))
+        for table in ("nodes", "ways_line", "ways_poly"):
+            where = data["where"].get(table, list())
+            select = data["select"].get(table, list())
+            if len(where) == 0 and table not in data.get("tables", list()):
+                continue
+            filter = {"any": list(), "all": list(), "keep": set(keep)}
+            for entry in select:
+                if isinstance(entry, str):
+                    filter["keep"].add(entry)
+                else:
+                    filter["keep"].update(entry.keys())
+            for entry in where:
+                op = entry.get("op") or "or"
+                for key, values in entry.items():
+                    if key == "op":
+                        continue
+                    # The key is always kept so the object can still be matched
+                    filter["keep"].add(key)
+                    term = (key, self._values(values))
+                    if op == "and":
+                        filter["all"].append(term)
+                    else:
+                        filter["any"].append(term)
+            filter["everything"] = len(where) == 0
+            # Other attributes in the select are columns, not tags
+            filter["keep"] -= {"osm_id", "version", "uid", "user", "changeset"}
+            self.filters[table].append(filter)
+            # Multipolygon relations are polygons
+            if table == "ways_poly":
+                self.filters["relations"].append(filter)
+
+    @staticmethod
+    def _values(values) -> list:
+        """Normalize the values of a where entry.
+
+        Args:
+            values (list, str): The values from the config
+
+        Returns:
+            (list): The tag values to match, empty matches any value
+        """
+        if values is None:
+            return list()
+        if not isinstance(values, list):
+            values = [values]
+        result = list()
+        for value in values:
+            if isinstance(value, list):
+                result.extend(value)
+            elif value == "not null":
+                return list()
+            else:
+                result.append("yes" if value is True else value)
+
+        return [str(value) for value in result]
+
+    def _luaFilters(self) -> str:
+        """Convert the filters to a Lua table.
+
+        Returns:
+            (str): The Lua source for the filters
+        """
+        lines = ["local filters = {"]
+        for table in TABLES:
+            lines.append(f"    {table} = {{")
+            for filter in self.filters[table]:
+                lines.append("        {")
+                everything = "true" if filter["everything"] else "false"
+                lines.append(f"            everything = {everything},")
+                for name in ("any", "all"):
+                    terms = list()
+                    for key, values in filter[name]:
+                        quoted = ", ".join([luaString(value) for value in values])
+                        terms.append(f"{{{luaString(key)}, {{{quoted}}}}}")
+                    lines.append(f"            {name} = {{{', '.join(terms)}}},")
+                keep = ", ".join([luaString(key) for key in sorted(filter["keep"])])
+                lines.append(f"            keep = {{{keep}}},")
+                lines.append("        },")
+            lines.append("    },")
+        lines.append("}")
+
+        return "\n".join(lines)
+
+    def generate(
+        self,
+        style: str = f"{rootdir}/import/raw.lua",
+    ) -> str:
+        """Generate the flex style.
+
+        Args:
+            style (str): The flex style to filter
+
+        Returns:
+            (str): The Lua source for the filtered style
+        """
+        with open(style, "r") as file:
+            base = file.read()
+        header = "-- Generated by osm_rawdata.flexstyle, only the objects matching\n"
+        header += "-- the query configs are imported, with the tags they use.\n\n"
+
+        return f"{header}{base}\n{self._luaFilters()}\n{WRAPPER}"
+
+    def write(
+        self,
+        outfile: str,
+    ) -> str:
+        """Write the flex style to a file, which can be passed to importOSM().
+
+        Args:
+            outfile (str): The file to write
+
+        Returns:
+            (str): The file written
+        """
+        with open(outfile, "w") as file:
+            file.write(self.generate())
+        log.info(f"Wrote {outfile}")
+
+        return outfile
+
+
+def main():
+    """This main function lets this class be run standalone by a bash script."""
+    parser = argparse.ArgumentParser(
+        prog="flexstyle",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Generate a filtered osm2pgsql flex style from query configs",
+        epilog="""
+        The style can be used with importer.py, or directly with osm2pgsql.
+        """,
+    )
+    parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
+    parser.add_argument(
+        "-i", "--infile", nargs="+", required=True, help="Query config files"
+    )
+    parser.add_argument("-o", "--outfile", default="filtered.lua", help="Output file")
+    args = parser.parse_args()
+
+    if len(argv) <= 1:
+        parser.print_help()
+        quit()
+
+    # if verbose, dump to the terminal.
+    if args.verbose is not None:
+        log.setLevel(logging.DEBUG)
+        ch = logging.StreamHandler(sys.stdout)
+        ch.setLevel(logging.DEBUG)
+        formatter = logging.Formatter(
+            "%(threadName)10s - %(name)s - %(levelname)s - %(message)s"
+        )
+        ch.setFormatter(formatter)
+        log.addHandler(ch)
+
+    style = FlexStyle(args.infile)
+    style.write(args.outfile)
+
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    main()
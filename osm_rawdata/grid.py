@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""The grid of cells the raw data tables are partitioned on."""
+
+import math
+
+# The size in degrees of the grid cells the tables are partitioned on,
+# this must match grid_size in the flex styles
+GRID_SIZE = 10
+GRID_COLUMNS = 360 // GRID_SIZE
+GRID_ROWS = 180 // GRID_SIZE
+
+
+def gridCell(
+    x: float,
+    y: float,
+) -> int:
+    """Get the grid cell a point is in.
+
+    The cell of a feature is the cell the centre of its bounding box is in.
+
+    Args:
+        x (float): The longitude
+        y (float): The latitude
+
+    Returns:
+        (int): The grid cell
+    """
+    column = min(max(math.floor((x + 180.0) / GRID_SIZE), 0), GRID_COLUMNS - 1)
+    row = min(max(math.floor((y + 90.0) / GRID_SIZE), 0), GRID_ROWS - 1)
+
+    return row * GRID_COLUMNS + column
+
+
+def gridCovering(
+    xmin: float,
+    ymin: float,
+    xmax: float,
+    ymax: float,
+) -> list:
+    """Get the grid cells that cover a bounding box.
+
+    Args:
+        xmin (float): The western edge
+        ymin (float): The southern edge
+        xmax (float): The eastern edge
+        ymax (float): The northern edge
+
+    Returns:
+        (list): The grid cells
+    """
+    first = gridCell(xmin, ymin)
+    last = gridCell(xmax, ymax)
+
+    return [
+        row * GRID_COLUMNS + column
+        for row in range(first // GRID_COLUMNS, last // GRID_COLUMNS + 1)
+        for column in range(first % GRID_COLUMNS, last % GRID_COLUMNS + 1)
+    ]
+
+
+def gridSql(column: str = "geom") -> str:
+    """Get the SQL to calculate the grid cell of a geometry, like gridCell().
+
+    Args:
+        column (str): The geometry column
+
+    Returns:
+        (str): The SQL expression
+    """
+    x = f"(ST_XMin({column}) + ST_XMax({column})) / 2"
+    y = f"(ST_YMin({column}) + ST_YMax({column})) / 2"
+    column = f"LEAST(GREATEST(floor(({x} + 180) / {GRID_SIZE}), 0), {GRID_COLUMNS - 1})"
+    row = f"LEAST(GREATEST(floor(({y} + 90) / {GRID_SIZE}), 0), {GRID_ROWS - 1})"
+
+    return f"({row} * {GRID_COLUMNS} + {column})::int"
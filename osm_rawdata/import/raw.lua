@@ -24,8 +24,31 @@
 -- Set projection to 4326
 local srid = 4326
 
+-- The size in degrees of the grid cells the tables are partitioned on,
+-- this must match GRID_SIZE in grid.py
+local grid_size = 10
+
+-- Returns the grid cell the centre of a bounding box is in.
+function grid_cell(minx, miny, maxx, maxy)
+    if minx == nil then
+        return nil
+    end
+    local columns = math.floor(360 / grid_size)
+    local rows = math.floor(180 / grid_size)
+    local column = math.floor(((minx + maxx) / 2 + 180) / grid_size)
+    local row = math.floor(((miny + maxy) / 2 + 90) / grid_size)
+    column = math.max(0, math.min(column, columns - 1))
+    row = math.max(0, math.min(row, rows - 1))
+    return row * columns + column
+end
+
 local tables = {}
 
+-- The centroid, bbox, area, and length columns are generated by postgres
+-- from the geometry, so they stay current when diffs are applied. The
+-- tables with them aren't clustered, as osm2pgsql clusters a table by
+-- copying it with CREATE TABLE AS, which loses the generated columns.
+
 tables.nodes = osm2pgsql.define_table{
     name="nodes",
     -- This will generate a derived nodes table which stores all the nodes feature with their point geometry
@@ -38,6 +61,7 @@ tables.nodes = osm2pgsql.define_table{
         { column = 'timestamp', sql_type = 'timestamp' },
         { column = 'tags', type = 'jsonb' },
         { column = 'geom', type = 'point', projection = srid },
+        { column = 'grid', type = 'int' },
         { column = 'country', sql_type= 'int[]', create_only = true },
     }
 
@@ -46,7 +70,12 @@ tables.nodes = osm2pgsql.define_table{
 tables.ways_line = osm2pgsql.define_table{
     name="ways_line",
     -- This will generate a derived ways line table which stores all the ways feature with linestring geometry
+    cluster = 'no',
     ids = {type='way',id_column = 'osm_id' },
+    indexes = {
+        { column = 'geom', method = 'gist' },
+        { column = 'centroid', method = 'gist' },
+    },
     columns = {
         { column = 'uid', type = 'int' },
         { column = 'user', type = 'text' },
@@ -54,8 +83,12 @@ tables.ways_line = osm2pgsql.define_table{
         { column = 'changeset', type = 'int' },
         { column = 'timestamp', sql_type = 'timestamp' },
         { column = 'tags', type = 'jsonb' },
-        { column = 'refs', type= 'text', sql_type = 'bigint[]'},
+        { column = 'refs', type = 'idlist' },
         { column = 'geom', type = 'linestring', projection = srid },
+        { column = 'centroid', sql_type = 'geometry(Point,4326) GENERATED ALWAYS AS (ST_Centroid(geom)) STORED', create_only = true },
+        { column = 'bbox', sql_type = 'geometry(Geometry,4326) GENERATED ALWAYS AS (ST_Envelope(geom)) STORED', create_only = true },
+        { column = 'length', sql_type = 'double precision GENERATED ALWAYS AS (ST_Length(geom::geography)) STORED', create_only = true },
+        { column = 'grid', type = 'int' },
         { column = 'country', sql_type= 'int[]', create_only = true },
     }
 
@@ -64,7 +97,12 @@ tables.ways_line = osm2pgsql.define_table{
 tables.ways_poly = osm2pgsql.define_table{
     name="ways_poly",
     -- This will generate a derived ways poly table which stores all the ways feature with polygon geometry
+    cluster = 'no',
     ids = {type='way',id_column = 'osm_id' },
+    indexes = {
+        { column = 'geom', method = 'gist' },
+        { column = 'centroid', method = 'gist' },
+    },
     columns = {
         { column = 'uid', type = 'int' },
         { column = 'user', type = 'text' },
@@ -73,8 +111,12 @@ tables.ways_poly = osm2pgsql.define_table{
         { column = 'timestamp', sql_type = 'timestamp' },
     -- This will store tags as jsonb type
         { column = 'tags', type = 'jsonb' },
-        { column = 'refs', type= 'text', sql_type = 'bigint[]'},
+        { column = 'refs', type = 'idlist' },
         { column = 'geom', type = 'polygon', projection = srid },
+        { column = 'centroid', sql_type = 'geometry(Point,4326) GENERATED ALWAYS AS (ST_Centroid(geom)) STORED', create_only = true },
+        { column = 'bbox', sql_type = 'geometry(Geometry,4326) GENERATED ALWAYS AS (ST_Envelope(geom)) STORED', create_only = true },
+        { column = 'area', sql_type = 'double precision GENERATED ALWAYS AS (ST_Area(geom::geography)) STORED', create_only = true },
+        { column = 'grid', type = 'int' },
         { column = 'country', sql_type= 'int[]', create_only = true },
     }
 
@@ -83,6 +125,7 @@ tables.ways_poly = osm2pgsql.define_table{
 tables.rels = osm2pgsql.define_table{
     name="relations",
     -- This will generate a derived realtion  table which stores all the relation feature to query without storing meta data parts and members
+    cluster = 'no',
 
     ids = {type='relation', id_column = 'osm_id' },
     columns = {
@@ -94,6 +137,8 @@ tables.rels = osm2pgsql.define_table{
         { column = 'tags', type = 'jsonb' },
         { column = 'refs', type = 'jsonb'},
         { column = 'geom', type = 'geometry', projection = srid },
+        { column = 'centroid', sql_type = 'geometry(Point,4326) GENERATED ALWAYS AS (ST_Centroid(geom)) STORED', create_only = true },
+        { column = 'bbox', sql_type = 'geometry(Geometry,4326) GENERATED ALWAYS AS (ST_Envelope(geom)) STORED', create_only = true },
         { column = 'country', sql_type= 'int[]', create_only = true },
     }
 }
@@ -119,6 +164,7 @@ function osm2pgsql.process_node(object)
         changeset = object.changeset,
         timestamp = os.date('!%Y-%m-%dT%H:%M:%SZ', object.timestamp),
         tags = object.tags,
+        grid = grid_cell(object:get_bbox()),
         geom = object:as_point()
     })
 end
@@ -135,9 +181,10 @@ function osm2pgsql.process_way(object)
             version = object.version,
             changeset = object.changeset,
             timestamp = os.date('!%Y-%m-%dT%H:%M:%SZ', object.timestamp),
-            refs = '{' .. table.concat(object.nodes, ',') .. '}',
+            refs = object.nodes,
             nodes=object.nodes,
             tags = object.tags,
+            grid = grid_cell(object:get_bbox()),
             geom = object:as_polygon();
         })
     else
@@ -147,9 +194,10 @@ function osm2pgsql.process_way(object)
             version = object.version,
             changeset = object.changeset,
             timestamp = os.date('!%Y-%m-%dT%H:%M:%SZ', object.timestamp),
-            refs = '{' .. table.concat(object.nodes, ',') .. '}',
+            refs = object.nodes,
             nodes=object.nodes,
             tags = object.tags,
+            grid = grid_cell(object:get_bbox()),
             geom = object:as_linestring();
         })
     end
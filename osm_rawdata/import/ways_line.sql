@@ -32,7 +32,11 @@ CREATE TABLE public.ways_line (
     changeset integer,
     "timestamp" timestamp without time zone,
     tags jsonb,
+    refs bigint[],
     geom public.geometry(LineString,4326),
+    centroid public.geometry(Point,4326) GENERATED ALWAYS AS (public.st_centroid(geom)) STORED,
+    bbox public.geometry(Geometry,4326) GENERATED ALWAYS AS (public.st_envelope(geom)) STORED,
+    length double precision GENERATED ALWAYS AS (public.st_length((geom)::public.geography, true)) STORED,
     grid integer
 );
 
@@ -46,6 +50,13 @@ ALTER TABLE public.ways_line OWNER TO rob;
 CREATE INDEX ways_line_geom_idx ON public.ways_line USING gist (geom) WITH (fillfactor='100');
 
 
+--
+-- Name: ways_line_centroid_idx; Type: INDEX; Schema: public; Owner: rob
+--
+
+CREATE INDEX ways_line_centroid_idx ON public.ways_line USING gist (centroid) WITH (fillfactor='100');
+
+
 --
 -- PostgreSQL database dump complete
 --
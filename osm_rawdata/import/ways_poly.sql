@@ -32,8 +32,11 @@ CREATE TABLE public.ways_poly (
     changeset integer,
     "timestamp" timestamp without time zone,
     tags jsonb,
-    refs text,
+    refs bigint[],
     geom public.geometry(Polygon,4326),
+    centroid public.geometry(Point,4326) GENERATED ALWAYS AS (public.st_centroid(geom)) STORED,
+    bbox public.geometry(Geometry,4326) GENERATED ALWAYS AS (public.st_envelope(geom)) STORED,
+    area double precision GENERATED ALWAYS AS (public.st_area((geom)::public.geography, true)) STORED,
     grid integer
 );
 
@@ -46,6 +49,13 @@ ALTER TABLE public.ways_poly OWNER TO rob;
 
 CREATE INDEX ways_poly_geom_idx ON public.ways_poly USING gist (geom) WITH (fillfactor='100');
 
+
+--
+-- Name: ways_poly_centroid_idx; Type: INDEX; Schema: public; Owner: rob
+--
+
+CREATE INDEX ways_poly_centroid_idx ON public.ways_poly USING gist (centroid) WITH (fillfactor='100');
+
 ALTER TABLE public.ways_poly CLUSTER ON ways_poly_geom_idx;
 
 
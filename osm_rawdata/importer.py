@@ -21,23 +21,30 @@
 
 import argparse
 import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import os
+import queue
+import re
 import subprocess
 import sys
+from datetime import datetime
 from pathlib import Path
 from sys import argv
 
-# from geoalchemy2 import shape
-import geoalchemy2
-import geojson
+import ijson
+import numpy as np
 from codetiming import Timer
 from cpuinfo import get_cpu_info
-from pandas import DataFrame
+from pyarrow import RecordBatch
 from shapely import wkb
-from shapely.geometry import shape
-from sqlalchemy import MetaData, cast, column, create_engine, select, table, text
-from sqlalchemy.dialects.postgresql import JSONB, insert
+from shapely.geometry import GeometryCollection, shape
+from sqlalchemy import create_engine, text
 from sqlalchemy.engine.base import Connection
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy_utils import create_database, database_exists
 
@@ -45,8 +52,26 @@ import osm_rawdata as od
 
 # Find the other files for this project
 import osm_rawdata.db_models
+from osm_rawdata.bulkload import (
+    BulkLoader,
+    IdAllocator,
+    contentHash,
+    createIdSequence,
+    createPartitions,
+    encodeTables,
+    forgetPartitions,
+    gridCells,
+    hilbertKeys,
+    importedUnits,
+    toEwkb,
+    unitDone,
+    wkbType,
+)
 from osm_rawdata.db_models import Base
-from osm_rawdata.overture import Overture
+from osm_rawdata.flexstyle import FlexStyle
+from osm_rawdata.grid import gridSql
+from osm_rawdata.overture import Overture, datasetFiles
+from osm_rawdata.pipeline import Pipeline
 from osm_rawdata.postgres import uriParser
 
 rootdir = od.__path__[0]
@@ -59,253 +84,1314 @@ log = logging.getLogger("osm-rawdata")
 info = get_cpu_info()
 cores = info["count"]
 
+# How many times the PBF size an in memory osm2pgsql import needs
+OSM2PGSQL_EXPANSION = 10
+
+# Inputs larger than this (in megabytes) use a flat nodes file
+OSM2PGSQL_FLAT_NODES = 8 * 1024
+
+# The raw data tables written by the importers
+TABLES = ("nodes", "ways_line", "ways_poly")
+
+# The indexes the raw data tables should have after a bulk load, if
+# the table has the column
+INDEXES = {"geom": "gist", "centroid": "gist", "tags": "gin"}
+
+# The statistics target for the tags the query configs filter on, the
+# default of 100 misses most values that aren't very common
+STATISTICS_TARGET = 1000
+
+# The database connection owned by a worker process
+connection = None
+
+# The maximum number of vertices in each piece of a country boundary,
+# smaller pieces make the spatial join much faster
+COUNTRY_VERTICES = 256
+
+# The Overture datasets that aren't imported, as the data is already
+# in OSM, or is mostly duplicated by it
+SKIPPED_DATASETS = ("OpenStreetMap", "Microsoft ML Buildings")
+
+# The file suffixes used for newline delimited GeoJson
+SEQUENCES = (".geojsonl", ".geojsonseq", ".geojsons", ".jsonl", ".ndjson")
+
+
+def makeBatch(
+    unit: dict,
+    tables: dict,
+    keys: dict = None,
+) -> dict:
+    """Encode the rows for each table as a batch for writeBatch().
+
+    Args:
+        unit (dict): The work unit for the import ledger
+        tables (dict): The rows for each table
+        keys (dict): The sort keys for each table, the rows are sorted if given
+
+    Returns:
+        (dict): The work unit, the encoded data, and the grid cells for each table
+    """
+    cells = dict()
+    for table, rows in tables.items():
+        cells[table] = sorted({row["grid"] for row in rows} - {None})
+
+    return {"unit": unit, "tables": encodeTables(tables, keys), "cells": cells}
+
+
+def convertGeoJson(
+    item: tuple,
+    sort: bool = False,
+    merge: bool = False,
+) -> dict:
+    """Convert a batch of GeoJson features to the data to COPY.
+
+    When merging, the source ID is the feature's id, or the osm_id or
+    @id property. Features without one are keyed on their geometry, so
+    the same feature in overlapping tiles is only imported once.
+
+    Args:
+        item (tuple): The work unit for the import ledger, the features,
+            and optionally the ranges of IDs from IdAllocator for them
+        sort (bool): Whether to sort the features along a Hilbert curve
+        merge (bool): Whether to add the source ID and content hash
+
+    Returns:
+        (dict): The work unit and the encoded data for each table
+    """
+    unit, data = item[:2]
+    ids = None
+    if len(item) > 2:
+        ids = itertools.chain.from_iterable(item[2])
+    if unit is not None:
+        checksum = hashlib.md5(json.dumps(data, sort_keys=True).encode())
+        unit = {**unit, "checksum": checksum.hexdigest()}
+
+    tables = {table: list() for table in TABLES}
+    keys = {table: list() for table in TABLES}
+    geoms = [shape(feature["geometry"]) for feature in data]
+    centres = np.zeros(len(geoms), dtype=np.int64)
+    cells = list()
+    if len(geoms) > 0:
+        xmin, ymin, xmax, ymax = np.array([geom.bounds for geom in geoms]).T
+        x, y = (xmin + xmax) / 2, (ymin + ymax) / 2
+        cells = gridCells(x, y)
+        if sort:
+            centres = hilbertKeys(x, y)
+    for feature, geom, key, cell in zip(data, geoms, centres, cells, strict=True):
+        tags = feature["properties"]
+        tags["building"] = "yes"
+        if geom.geom_type == "Polygon":
+            table = "ways_poly"
+        elif geom.geom_type == "Point":
+            table = "nodes"
+        elif geom.geom_type == "LineString":
+            table = "ways_line"
+        else:
+            log.error(f"geometry type {geom.geom_type} is unsupported!")
+            continue
+        row = {"geom": wkb.dumps(geom, srid=4326), "tags": tags, "grid": cell}
+        if ids is not None:
+            # The IDs are negative so they don't clash with OSM data
+            row["osm_id"] = -next(ids)
+        if merge:
+            source = feature.get("id") or tags.get("osm_id") or tags.get("@id")
+            if source is None:
+                source = hashlib.md5(row["geom"]).hexdigest()
+            row["source_id"] = str(source)
+            row["hash"] = contentHash(row["geom"], tags)
+        tables[table].append(row)
+        keys[table].append(key)
+
+    return makeBatch(unit, tables, keys if sort else None)
+
+
+def writeBatch(
+    batch: dict,
+    db: Connection,
+    merge: bool = False,
+    dedup: bool = False,
+) -> int:
+    """Write a converted batch, and record it in the import ledger.
+
+    Args:
+        batch (dict): The work unit and the encoded data for each table
+        db (Connection): A database connection
+        merge (bool): Whether to merge the rows on their source ID
+        dedup (bool): Whether to skip polygons that duplicate OSM buildings
+
+    Returns:
+        (int): The number of rows written
+    """
+    # The partitions are committed before the work unit's transaction
+    # starts, so it either has all of its rows or none of them
+    for table in batch["tables"]:
+        createPartitions(db, table, batch["cells"][table])
+    unit = batch["unit"]
+    if unit is not None and unitDone(db, unit):
+        log.debug(f"Skipping {unit['unit']}, it's already imported")
+        db.commit()
+        return 0
+
+    loader = BulkLoader(db, merge=merge, dedup=dedup)
+    for table, (columns, data, count) in batch["tables"].items():
+        loader.copyData(table, columns, data, count)
+    rows = loader.flush(unit)
+    log.debug(f"Wrote {rows} rows at {loader.rate():.0f} rows/sec")
+    if merge:
+        log.debug(f"{loader.changed} of {rows} rows were new or changed")
+    elif dedup:
+        log.debug(f"Skipped {loader.duplicates} duplicates of OSM buildings")
+
+    return rows
+
 
 def importThread(
     data: list,
     db: Connection,
-):
+    unit: dict = None,
+    sort: bool = False,
+    ids: IdAllocator = None,
+) -> int:
     """Thread to handle importing
 
     Args:
-        data (list): The list of tiles to download
+        data (list): The list of features to import
         db (Connection): A database connection
+        unit (dict): The source and range of the work unit for the import ledger
+        sort (bool): Whether to sort the features along a Hilbert curve
+        ids (IdAllocator): The allocator for the feature IDs
+
+    Returns:
+        (int): The number of rows written
     """
-    # log.debug(f"In importThread()")
-    # timer = Timer(text="importThread() took {seconds:.0f}s")
-    # timer.start()
-    ways = table(
-        "ways_poly",
-        column("id"),
-        column("user"),
-        column("geom"),
-        column("tags"),
-    )
+    if ids is None:
+        ids = IdAllocator(db)
 
-    nodes = table(
-        "nodes",
-        column("id"),
-        column("user"),
-        column("geom"),
-        column("tags"),
-    )
+    return writeBatch(convertGeoJson((unit, data, ids.allocate(len(data))), sort), db)
 
-    nodes = table(
-        "ways_line",
-        column("id"),
-        column("user"),
-        column("geom"),
-        column("tags"),
-    )
 
-    index = 0
+def readGeoJson(
+    infile: str,
+    batch: int = 10000,
+):
+    """Incrementally read the features from a GeoJson or GeoJsonSeq file.
 
-    for feature in data:
-        # log.debug(feature)
-        index -= 1
-        entry = dict()
-        tags = feature["properties"]
-        tags["building"] = "yes"
-        entry["id"] = index
-        ewkt = shape(feature["geometry"])
-        geom = wkb.dumps(ewkt)
-        type = ewkt.geom_type
-        scalar = select(cast(tags, JSONB)).scalar_subquery()
-
-        if type == "Polygon":
-            sql = insert(ways).values(
-                # id = entry['id'],
-                geom=geom,
-                tags=scalar,
-            )
-        elif type == "Point":
-            sql = insert(nodes).values(
-                # id = entry['id'],
-                geom=geom,
-                tags=scalar,
-            )
+    Args:
+        infile (str): The file to read
+        batch (int): The number of features in each batch
+
+    Returns:
+        (generator): Lists of at most batch features
+    """
+    features = list()
+    with open(infile, "rb") as file:
+        sequence = Path(infile).suffix in SEQUENCES or file.peek(1)[:1] == b"\x1e"
+        if sequence:
+            # GeoJsonSeq has one feature per line, optionally with a
+            # leading record separator
+            items = (json.loads(line.lstrip(b"\x1e")) for line in file if line.strip())
+        else:
+            items = ijson.items(file, "features.item", use_float=True)
+        for feature in items:
+            features.append(feature)
+            if len(features) >= batch:
+                yield features
+                features = list()
+    if len(features) > 0:
+        yield features
+
+
+def splitLines(
+    infile: str,
+    parts: int,
+) -> list:
+    """Split a newline delimited file into byte ranges that start on a line.
+
+    Args:
+        infile (str): The file to split
+        parts (int): The number of ranges wanted
+
+    Returns:
+        (list): The start and end offset of each range, there may be fewer
+            than asked for if the lines are long
+    """
+    size = os.path.getsize(infile)
+    starts = [0]
+    with open(infile, "rb") as file:
+        for part in range(1, parts):
+            # Skip the rest of the line the offset is in
+            file.seek(max(size * part // parts, starts[-1], 1) - 1)
+            file.readline()
+            start = file.tell()
+            if start > starts[-1] and start < size:
+                starts.append(start)
+
+    return list(zip(starts, starts[1:] + [size], strict=True))
+
+
+def readLines(
+    infile: str,
+    start: int,
+    end: int,
+    batch: int = 10000,
+):
+    """Read the features in a byte range of a GeoJsonSeq file.
 
-        db.execute(sql)
-        # db.commit()
+    Args:
+        infile (str): The file to read
+        start (int): The offset of the first line, from splitLines()
+        end (int): The offset after the last line
+        batch (int): The number of features in each batch
+
+    Returns:
+        (generator): The start and end offset of each batch, and its features
+    """
+    features = list()
+    with open(infile, "rb") as file:
+        file.seek(start)
+        first = offset = start
+        while offset < end:
+            line = file.readline()
+            if not line:
+                break
+            offset += len(line)
+            if line.strip():
+                features.append(json.loads(line.lstrip(b"\x1e")))
+            if len(features) >= batch:
+                yield (first, offset, features)
+                first = offset
+                features = list()
+    if len(features) > 0:
+        yield (first, offset, features)
+
+
+def convertParquet(
+    item: tuple,
+    sort: bool = False,
+    merge: bool = False,
+    exclude: tuple = SKIPPED_DATASETS,
+) -> dict:
+    """Convert a batch of Overture features to the data to COPY.
+
+    When merging, the source ID is the GERS id of the feature.
+
+    Args:
+        item (tuple): The work unit for the import ledger, the RecordBatch,
+            and optionally the ranges of IDs from IdAllocator for its rows
+        sort (bool): Whether to sort the features along a Hilbert curve
+        merge (bool): Whether to add the source ID and content hash
+        exclude (tuple): The Overture datasets to skip
+
+    Returns:
+        (dict): The work unit and the encoded data for each table
+    """
+    unit, data = item[:2]
+    ids = None
+    if len(item) > 2:
+        ids = itertools.chain.from_iterable(item[2])
+    log.debug(f"There are {data.num_rows} entries in the data")
+
+    # This is a no-op for row groups from readGroup(), which are already
+    # filtered the same way
+    overture = Overture(exclude=exclude)
+    data = overture.filter(data)
+    tables = {table: list() for table in TABLES}
+    keys = {table: list() for table in TABLES}
+    entries = overture.parseBatch(data)
+    geometries = data.column("geometry").to_pylist()
+    sources = [None] * data.num_rows
+    if merge:
+        sources = data.column("id").to_pylist()
+    centres = np.zeros(data.num_rows, dtype=np.int64)
+    cells = list()
+    if data.num_rows > 0:
+        x, y = overture.centres(data)
+        cells = gridCells(x, y)
+        if sort:
+            centres = hilbertKeys(x, y)
+    rows = zip(entries, geometries, sources, centres, cells, strict=True)
+    for tags, geom, source, key, cell in rows:
+        osm_id = -next(ids) if ids is not None else None
+        if isinstance(geom, str):
+            geom = bytes.fromhex(geom)
+        geom_type = wkbType(geom)
+        if geom_type == "Polygon":
+            table = "ways_poly"
+        elif geom_type == "MultiPolygon":
+            # The ways_poly table only stores polygons
+            geom = wkb.dumps(wkb.loads(geom).convex_hull, srid=4326)
+            table = "ways_poly"
+        elif geom_type == "Point":
+            table = "nodes"
+        elif geom_type == "LineString":
+            table = "ways_line"
+        else:
+            log.error(f"geometry type {geom_type} is unsupported!")
+            continue
+        row = {"geom": toEwkb(geom), "tags": tags, "grid": cell}
+        if osm_id is not None:
+            row["osm_id"] = osm_id
+        if merge:
+            row["source_id"] = source
+            row["hash"] = contentHash(row["geom"], tags)
+        tables[table].append(row)
+        keys[table].append(key)
+
+    return makeBatch(unit, tables, keys if sort else None)
 
 
 def parquetThread(
-    data: DataFrame,
+    data: RecordBatch,
     db: Connection,
-):
+    unit: dict = None,
+    sort: bool = False,
+    ids: IdAllocator = None,
+    exclude: tuple = SKIPPED_DATASETS,
+) -> int:
     """Thread to handle importing
 
     Args:
-        data (list): The list of tiles to download
+        data (RecordBatch): A batch of Overture features
         db (Connection): A database connection
+        unit (dict): The work unit to record in the import ledger
+        sort (bool): Whether to sort the features along a Hilbert curve
+        ids (IdAllocator): The allocator for the feature IDs
+        exclude (tuple): The Overture datasets to skip
+
+    Returns:
+        (int): The number of rows written
     """
     timer = Timer(text="parquetThread() took {seconds:.0f}s")
     timer.start()
-    ways = table(
-        "ways_poly",
-        column("id"),
-        column("user"),
-        column("geom"),
-        column("tags"),
-    )
+    if ids is None:
+        ids = IdAllocator(db)
+    data = Overture(exclude=exclude).filter(data)
+    item = (unit, data, ids.allocate(data.num_rows))
+    rows = writeBatch(convertParquet(item, sort, exclude=exclude), db)
+    timer.stop()
 
-    nodes = table(
-        "nodes",
-        column("id"),
-        column("user"),
-        column("geom"),
-        column("tags"),
-    )
+    return rows
 
-    lines = table(
-        "ways_line",
-        column("id"),
-        column("user"),
-        column("geom"),
-        column("tags"),
-    )
 
-    index = -1
-    log.debug(f"There are {len(data)} entries in the data")
-    if len(data) == 0:
-        return
+def availableMemory() -> int:
+    """Get the memory available on this machine.
 
-    overture = Overture()
-    for index in data.index:
-        feature = data.loc[index]
-        dataset = feature["sources"][0]["dataset"]
-        if dataset == "OpenStreetMap" or dataset == "Microsoft ML Buildings":
-            continue
-        tags = overture.parse(feature)
-        geom = feature["geometry"]
-        hex = wkb.loads(geom, hex=True)
-        gdata = geoalchemy2.shape.from_shape(hex, srid=4326, extended=True)
-        # geom_type = wkb.loads(geom).geom_type
-        scalar = select(cast(tags["properties"], JSONB)).scalar_subquery()
-        sql = None
-        if hex.geom_type == "Polygon":
-            sql = insert(ways).values(
-                # osm_id = entry['osm_id'],
-                geom=bytes(gdata.data),
-                tags=scalar,
-            )
-        elif hex.geom_type == "MultiPolygon":
-            gdata = geoalchemy2.shape.from_shape(
-                hex.convex_hull, srid=4326, extended=True
-            )
-            sql = insert(ways).values(
-                geom=bytes(gdata.data),
-                tags=scalar,
-            )
-        elif hex.geom_type == "Point":
-            sql = insert(nodes).values(
-                # osm_id = entry['osm_id'],
-                geom=bytes(gdata.data),
-                tags=scalar,
-            )
-        elif hex.geom_type == "LineString":
-            sql = insert(lines).values(
-                # osm_id = entry['osm_id'],
-                geom=bytes(gdata.data),
-                tags=scalar,
-            )
-        else:
-            log.error(f"geometry type {geom_type} is unsupported!")
+    Returns:
+        (int): The available memory in megabytes
+    """
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+
+
+def osm2pgsqlProfile(
+    infile: str,
+    memory: int = None,
+    processes: int = cores,
+    drop: bool = False,
+    flat_nodes: str = None,
+) -> dict:
+    """Pick the osm2pgsql settings for the input size and this machine.
+
+    Small files are imported in memory. When the node locations won't
+    fit in memory slim mode is used, and large inputs also store the
+    node locations in a flat nodes file. Use drop for one-shot imports
+    that will never be updated.
+
+    Args:
+        infile (str): The OSM data file
+        memory (int): The memory to use in megabytes, default is what's available
+        processes (int): The number of osm2pgsql processes
+        drop (bool): Whether to drop the slim tables after the import
+        flat_nodes (str): The flat nodes file, default is next to the input
+
+    Returns:
+        (dict): The osm2pgsql settings
+    """
+    if memory is None:
+        memory = availableMemory()
+    size = os.path.getsize(infile) // (1024 * 1024)
+
+    # An in memory import needs several times the size of the PBF
+    slim = drop or size * OSM2PGSQL_EXPANSION > memory // 2
+    nodes = None
+    if slim and size > OSM2PGSQL_FLAT_NODES:
+        nodes = flat_nodes or str(Path(infile).with_suffix(".nodes"))
+
+    # Leave some memory for postgres and the lua processes
+    cache = min(size * OSM2PGSQL_EXPANSION, memory * 3 // 4)
+    if nodes:
+        # The node cache is barely used with a flat nodes file
+        cache = 0
+
+    return {
+        "slim": slim,
+        "flat_nodes": nodes,
+        "cache": max(cache, 0),
+        "processes": max(processes, 1),
+        "drop": drop and slim,
+    }
+
+
+def parseOsm2pgsql(lines: list) -> dict:
+    """Parse the stage timings and object counts from osm2pgsql's output.
+
+    Args:
+        lines (list): The lines osm2pgsql wrote
+
+    Returns:
+        (dict): The seconds each stage took, the objects processed,
+            and the total seconds
+    """
+    result = {"stages": dict(), "objects": dict(), "total": None}
+    for line in lines:
+        # Strip the timestamp osm2pgsql puts on each line
+        line = re.sub(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\s+", "", line.strip())
+        if match := re.search(r"osm2pgsql took (\d+)s", line):
+            result["total"] = int(match.group(1))
+        elif match := re.search(
+            r"(Node|Way|Relation) stats: total\((\d+)\), max\((\d+)\) in (\d+)s",
+            line,
+        ):
+            result["objects"][match.group(1).lower()] = {
+                "total": int(match.group(2)),
+                "max": int(match.group(3)),
+                "seconds": int(match.group(4)),
+            }
+        elif match := re.search(r"^(.+?) (?:done|finished) in (\d+)s", line):
+            result["stages"][match.group(1)] = int(match.group(2))
+
+    return result
+
+
+def readChanges(directory: str) -> list:
+    """Find the OSM change files in a replication directory.
+
+    Args:
+        directory (str): The directory of .osc.gz files
+
+    Returns:
+        (list): The sequence number and path of each change file
+    """
+    changes = list()
+    top = Path(directory)
+    for path in top.rglob("*.osc.gz"):
+        # 000/123/456.osc.gz is sequence 123456
+        name = str(path.relative_to(top))[: -len(".osc.gz")]
+        digits = "".join(re.findall(r"\d+", name))
+        if digits:
+            changes.append((int(digits), path))
+
+    return changes
+
+
+def readState(path: Path) -> dict:
+    """Read the state.txt that goes with a change file.
+
+    Args:
+        path (Path): The change file
+
+    Returns:
+        (dict): The sequence number and timestamp, empty if there's no state
+    """
+    state = dict()
+    statefile = path.with_name(path.name.replace(".osc.gz", ".state.txt"))
+    if not statefile.exists():
+        return state
+    with open(statefile, "r") as file:
+        for line in file:
+            if line.startswith("sequenceNumber="):
+                state["sequence"] = int(line.split("=", 1)[1])
+            elif line.startswith("timestamp="):
+                # The colons are escaped in the state file
+                value = line.split("=", 1)[1].strip().replace("\\", "")
+                state["timestamp"] = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+    return state
+
+
+def tagPredicates(configs: list) -> dict:
+    """Get the tags the query configs filter each table on.
+
+    Args:
+        configs (list): The QueryConfigs, or the YAML or JSON files to parse
+
+    Returns:
+        (dict): The tag keys, and the values to match, for each table
+    """
+    style = FlexStyle(configs)
+    predicates = dict()
+    for table in TABLES:
+        terms = list()
+        for filter in style.filters[table]:
+            for term in filter["any"] + filter["all"]:
+                if term not in terms:
+                    terms.append(term)
+        predicates[table] = terms
+
+    return predicates
+
+
+def tagPredicate(
+    key: str,
+    values: list,
+) -> str:
+    """Get the SQL for a tag filter, the same way createSQL() writes it.
+
+    Args:
+        key (str): The tag key
+        values (list): The values to match, empty matches any value
+
+    Returns:
+        (str): The SQL for the WHERE clause
+    """
+    key = key.replace("'", "''")
+    quoted = ", ".join(["'" + value.replace("'", "''") + "'" for value in values])
+    if len(values) == 0:
+        return f"tags->>'{key}' IS NOT NULL"
+    elif len(values) == 1:
+        return f"tags->>'{key}' = {quoted}"
+
+    return f"tags->>'{key}' IN ({quoted})"
+
+
+def estimateError(
+    estimate: float,
+    actual: int,
+) -> float:
+    """Get how far the planner's row estimate was from the actual rows.
+
+    Args:
+        estimate (float): The rows the planner estimated
+        actual (int): The rows that matched
+
+    Returns:
+        (float): The factor the estimate was off by, 1 when it was exact
+    """
+    estimate = max(estimate, 1)
+    actual = max(actual, 1)
+
+    return max(estimate / actual, actual / estimate)
+
+
+def indexMethod(indexdef: str) -> str:
+    """Get the method and columns of an index from its definition.
+
+    Args:
+        indexdef (str): The CREATE INDEX statement, as in pg_indexes
+
+    Returns:
+        (str): The method and columns, for example gist (geom)
+    """
+    using = indexdef.split(" USING ")[1]
+    match = re.match(r"\w+ \([^)]*\)", using)
+
+    return match.group(0) if match else using
+
+
+def searchPath(
+    db: Connection,
+    schema: str = None,
+):
+    """Set the schema a connection writes to, for staged imports.
+
+    Args:
+        db (Connection): A database connection
+        schema (str): The staging schema, or None for the live tables
+    """
+    if schema is None:
+        db.execute(text("RESET search_path"))
+    else:
+        db.execute(text(f"SET search_path TO {schema}, public"))
+    db.commit()
+
+
+def workerInit(
+    dburi: str,
+    schema: str = None,
+):
+    """Open the database connection owned by a worker process.
+
+    Args:
+        dburi (str): The URI string for the database connection
+        schema (str): The staging schema to write to, if any
+    """
+    global connection
+    engine = create_engine(f"postgresql://{dburi}", echo=False)
+    connection = engine.connect()
+    if schema is not None:
+        searchPath(connection, schema)
+
+
+def parquetWorker(
+    infile: str,
+    groups: range,
+    db: Connection = None,
+    sort: bool = False,
+    merge: bool = False,
+    dedup: bool = False,
+    aoi: tuple = None,
+    exclude: tuple = SKIPPED_DATASETS,
+) -> int:
+    """Process to import some of the row groups from a parquet file.
+
+    Each row group is committed along with its entry in the import
+    ledger, and row groups already in the ledger are skipped. With an
+    AOI the ledger entry includes it, so other AOIs can be imported
+    from the same file.
+
+    Args:
+        infile (str): The parquet file
+        groups (list): The row groups to import
+        db (Connection): A database connection, default is the worker's
+        sort (bool): Whether to sort the features along a Hilbert curve
+        merge (bool): Whether to merge the features on their GERS id
+        dedup (bool): Whether to skip buildings that duplicate OSM ones
+        aoi (tuple): The bounds of the area of interest, if any
+        exclude (tuple): The Overture datasets to skip
+
+    Returns:
+        (int): The number of rows written
+    """
+    log.debug(f"Importing row groups {groups[0]}-{groups[-1]} from {infile}")
+    if db is None:
+        db = connection
+    overture = Overture(infile, aoi, exclude)
+    suffix = ""
+    if aoi is not None:
+        suffix = f"@{','.join([str(value) for value in aoi])}"
+    source = str(Path(infile).resolve())
+    imported = importedUnits(db, source)
+
+    # The IDs are allocated before the writer starts using the connection
+    ids = IdAllocator(db)
+    units = list()
+    for group in groups:
+        unit = {
+            "source": source,
+            "unit": f"row_group:{group}{suffix}",
+            "checksum": overture.checksum(group),
+        }
+        # A changed row group is caught by unitDone() when it's written
+        if imported.get(unit["unit"]) == unit["checksum"]:
+            log.debug(f"Skipping row group {group}, it's already imported")
             continue
+        # Only the rows left after filtering get IDs, so they stay dense
+        units.append((group, unit, ids.allocate(overture.countRows(group))))
+
+    def read():
+        for group, unit, ranges in units:
+            yield (unit, overture.readGroup(group), ranges)
+
+    # Reading the next row group and writing the last one overlap the conversion
+    pipeline = Pipeline()
+    pipeline.addStage(
+        functools.partial(convertParquet, sort=sort, merge=merge, exclude=exclude),
+        name="convert",
+    )
+    pipeline.addStage(writeBatch, args=[(db, merge, dedup)], name="write")
 
-        index -= 1
-        db.execute(sql)
-        # db.commit()
-        # print(f"FIXME2: {entry}")
-    timer.stop()
+    return sum(pipeline.run(read()))
+
+
+def sequenceWorker(
+    infile: str,
+    start: int,
+    end: int,
+    batch: int = 10000,
+    sort: bool = False,
+    merge: bool = False,
+    db: Connection = None,
+) -> int:
+    """Process to decode and import a byte range of a GeoJsonSeq file.
+
+    Args:
+        infile (str): The GeoJsonSeq file
+        start (int): The offset of the first line, from splitLines()
+        end (int): The offset after the last line
+        batch (int): The number of features in each batch
+        sort (bool): Whether to sort the features along a Hilbert curve
+        merge (bool): Whether to merge the features on their source ID
+        db (Connection): A database connection, default is the worker's
+
+    Returns:
+        (int): The number of rows written
+    """
+    log.debug(f"Importing bytes {start}:{end} from {infile}")
+    if db is None:
+        db = connection
+    source = str(Path(infile).resolve())
+    ids = IdAllocator(db)
+    rows = 0
+    for first, last, features in readLines(infile, start, end, batch):
+        unit = {"source": source, "unit": f"bytes:{first}-{last}"}
+        item = (unit, features, ids.allocate(len(features)))
+        rows += writeBatch(convertGeoJson(item, sort, merge), db, merge)
+
+    return rows
 
 
 class MapImporter(object):
     def __init__(
         self,
         dburi: str,
+        limit: int = cores + 1,
     ):
         """This is a class to setup a local database for OSM data.
 
+        The database connections are opened as they are needed, up to
+        the limit, and reused by every import.
+
         Args:
             dburi (str): The URI string for the database connection
+            limit (int): The maximum number of database connections, at
+                least two, one for the caller and one for a writer
 
         Returns:
             (OsmImporter): An instance of this class
         """
         self.dburi = dburi
         self.db = None
-        self.connections = list()
-        for thread in range(0, cores + 1):
-            engine = create_engine(f"postgresql://{self.dburi}", echo=False)
-            if not database_exists(engine.url):
-                create_database(engine.url)
-            self.connections.append(engine.connect())
-            sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-            if thread == 0:
-                meta = MetaData()
-                meta.create_all(engine)
-
-                # if dburi:
-                # self.uri = uriParser(dburi)
-                # engine = create_engine(f"postgresql://{self.dburi}", echo=True)
-                # if not database_exists(engine.url):
-                #     create_database(engine.url)
-                # self.db = engine.connect()
-
-                # Add the extension we need to process the data
-                sql = text(
-                    "CREATE EXTENSION IF NOT EXISTS postgis; CREATE EXTENSION IF NOT EXISTS hstore;CREATE EXTENSION IF NOT EXISTS dblink;"
-                )
-                self.connections[0].execute(sql)
+        self.schema = None
+        self.limit = max(limit, 2)
+        self.engine = create_engine(
+            f"postgresql://{self.dburi}",
+            echo=False,
+            pool_size=self.limit,
+            max_overflow=0,
+        )
+        if not database_exists(self.engine.url):
+            create_database(self.engine.url)
+        self.connections = [self.engine.connect()]
+
+        # if dburi:
+        # self.uri = uriParser(dburi)
+        # engine = create_engine(f"postgresql://{self.dburi}", echo=True)
+        # if not database_exists(engine.url):
+        #     create_database(engine.url)
+        # self.db = engine.connect()
+
+        # Add the extension we need to process the data
+        sql = text(
+            "CREATE EXTENSION IF NOT EXISTS postgis; CREATE EXTENSION IF NOT EXISTS hstore;CREATE EXTENSION IF NOT EXISTS dblink;"
+        )
+        self.connections[0].execute(sql)
+
+        Base.metadata.create_all(bind=self.connections[0])
+        self.connections[0].commit()
+        createIdSequence(self.connections[0])
+
+        sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+
+        # Create indexes to improve peformance
+        # sql = text("cluster ways_poly using ways_poly_geom_idx;")
+        # self.db.execute(sql)
+        # sql("create index on ways_poly using gin(tags)")
+        # self.db.execute(sql)
+        # self.db.commit()
+
+    def connect(
+        self,
+        count: int,
+    ) -> list:
+        """Get database connections, opening more if needed up to the limit.
+
+        Args:
+            count (int): The number of connections wanted
+
+        Returns:
+            (list): The connections, there may be fewer than asked for
+        """
+        count = max(1, min(count, self.limit))
+        while len(self.connections) < count:
+            db = self.engine.connect()
+            if self.schema is not None:
+                searchPath(db, self.schema)
+            self.connections.append(db)
+
+        return self.connections[:count]
+
+    def release(self):
+        """Close all but the first database connection.
+
+        This is used before starting worker processes, which each open
+        their own connection, so the total stays within the limit.
+        """
+        for db in self.connections[1:]:
+            db.close()
+        del self.connections[1:]
+        # The closed connections are kept open in the pool otherwise
+        self.engine.dispose(close=True)
+
+    def _runPooled(
+        self,
+        function,
+        jobs: list,
+        workers: int = None,
+    ) -> list:
+        """Run a function on each job in threads, each using a pooled connection.
+
+        The function is called with a connection, followed by the
+        arguments of the job. If it fails, the connection is rolled back
+        and the error is raised.
+
+        Args:
+            function (callable): The function to run
+            jobs (list): The arguments for each call, as tuples
+            workers (int): The most connections to use, by default one for each job
+
+        Returns:
+            (list): What the function returned for each job, in the same order
+        """
+        connections = queue.Queue()
+        for db in self.connect(len(jobs) if workers is None else workers):
+            connections.put(db)
+
+        def run(job: tuple):
+            db = connections.get()
+            try:
+                return function(db, *job)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                connections.put(db)
+
+        workers = connections.qsize()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, jobs))
+
+    def _processWorkers(
+        self,
+        workers: int,
+    ) -> int:
+        """Make room in the connection limit for worker processes.
+
+        The worker processes can't share the pool, so they each open one
+        connection, and the idle connections in the pool are closed first.
 
-                Base.metadata.create_all(bind=engine)
+        Args:
+            workers (int): The number of worker processes wanted
+
+        Returns:
+            (int): The number of worker processes to start, within the limit
+        """
+        self.release()
 
-                sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        return max(1, min(workers, self.limit - 1))
+
+    def createStaging(
+        self,
+        schema: str = "staging",
+    ):
+        """Write the following imports to staging tables.
 
-            # Create indexes to improve peformance
-            # sql = text("cluster ways_poly using ways_poly_geom_idx;")
-            # self.db.execute(sql)
-            # sql("create index on ways_poly using gin(tags)")
-            # self.db.execute(sql)
-            # self.db.commit()
+        The staging tables are UNLOGGED copies of the raw data tables,
+        without their indexes, in their own schema, so loading them
+        writes no WAL and extracts keep using the live tables. A live
+        table partitioned on the grid cell is staged partitioned too,
+        with unlogged partitions. Use swapStaging() when the import is
+        done.
+
+        Args:
+            schema (str): The schema for the staging tables
+        """
+        db = self.connections[0]
+        db.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        db.execute(text(f"CREATE SCHEMA {schema}"))
+        # The primary keys and unique constraints are added by swapStaging()
+        like = "INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED"
+        like += " INCLUDING IDENTITY INCLUDING STORAGE"
+        sql = text("SELECT pg_get_partkeydef(to_regclass(:table))")
+        # The ledger is staged too, as the staged tables start empty
+        for table in TABLES + ("import_ledger",):
+            staged = f"{schema}.{table}"
+            columns = f"(LIKE public.{table} {like})"
+            key = db.execute(sql, {"table": f"public.{table}"}).scalar()
+            if key is None:
+                db.execute(text(f"CREATE UNLOGGED TABLE {staged} {columns}"))
+                continue
+            # A partitioned table has no storage of its own, so only its
+            # partitions are unlogged, and the importers add the ones they need
+            db.execute(text(f"CREATE TABLE {staged} {columns} PARTITION BY {key}"))
+            default = f"{staged}_grid_default PARTITION OF {staged} DEFAULT"
+            db.execute(text(f"CREATE UNLOGGED TABLE {default}"))
+        db.commit()
+        self.schema = schema
+        for db in self.connections:
+            searchPath(db, schema)
+        # The writers in this process check which staged tables are partitioned
+        forgetPartitions()
+        log.info(f"Importing into the {schema} schema")
+
+    def swapStaging(
+        self,
+        logged: bool = False,
+        keep: bool = False,
+        timeout: str = "5s",
+        retries: int = 3,
+    ) -> dict:
+        """Replace the live tables with the staging tables.
+
+        The indexes and unique constraints of the live tables are built
+        on the staging tables, which are then analyzed, and moved into
+        place with their partitions in one short transaction, so
+        extracts see either the old data or the new data. Any other
+        tables in the staging schema, like those from osm2pgsql, are
+        moved as well.
+
+        Args:
+            logged (bool): Whether to make the tables logged first, otherwise
+                they are emptied if postgres crashes and aren't replicated
+            keep (bool): Whether to keep the old tables in the retired schema
+            timeout (str): How long the swap waits for a lock before trying again
+            retries (int): How many times to try the swap
+
+        Returns:
+            (dict): The time in seconds each phase took
+        """
+        schema = self.schema
+        if schema is None:
+            msg = "There are no staging tables, use createStaging() first"
+            log.error(msg)
+            raise ValueError(msg)
+        retired = f"{schema}_retired"
+        db = self.connections[0]
+        # The partitions are made logged and moved along with their table
+        sql = text(
+            "SELECT relname, relkind, relispartition FROM pg_class "
+            "WHERE relnamespace = to_regnamespace(:schema) AND relkind IN ('r', 'p')"
+        )
+        relations = db.execute(sql, {"schema": schema}).all()
+        tables = [name for name, kind, partition in relations if not partition]
+        sql = text("SELECT indexname FROM pg_indexes WHERE schemaname = :schema")
+        staged = set(db.execute(sql, {"schema": schema}).scalars().all())
+        # The primary keys and unique constraints are added as constraints,
+        # not just as their indexes
+        sql = text(
+            "SELECT relname, conname, pg_get_constraintdef(pg_constraint.oid) "
+            "FROM pg_constraint JOIN pg_class ON pg_class.oid = conrelid "
+            "WHERE relnamespace = 'public'::regnamespace AND relname = ANY(:tables) "
+            "AND contype IN ('p', 'u', 'x')"
+        )
+        constraints = [
+            f'ALTER TABLE {schema}.{table} ADD CONSTRAINT "{name}" {definition}'
+            for table, name, definition in db.execute(sql, {"tables": tables}).all()
+            if name not in staged
+        ]
+        sql = text(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE schemaname = 'public' AND tablename = ANY(:tables) "
+            "AND NOT EXISTS (SELECT 1 FROM pg_constraint "
+            "WHERE contype IN ('p', 'u', 'x') "
+            "AND conindid = format('%I.%I', schemaname, indexname)::regclass)"
+        )
+        # Partitioned live tables have their indexes ON ONLY the parent,
+        # which are built on each partition of the staged table instead
+        indexes = [
+            re.sub(r" ON (ONLY )?public\.", f" ON {schema}.", indexdef, count=1)
+            for name, indexdef in db.execute(sql, {"tables": tables}).all()
+            if name not in staged
+        ]
+        db.commit()
+        timings = self.createIndexes(constraints + indexes)
+
+        timer = Timer(text="Analyzing the staging tables took {seconds:.0f}s")
+        timer.start()
+        for name, kind, _partition in relations:
+            # A partitioned table has no storage to log
+            if logged and kind == "r":
+                db.execute(text(f"ALTER TABLE {schema}.{name} SET LOGGED"))
+                db.commit()
+        for table in tables:
+            # Analyzing a partitioned table analyzes its partitions too
+            db.execute(text(f"ANALYZE {schema}.{table}"))
+            db.commit()
+        timings["analyze"] = timer.stop()
+
+        timer = Timer(text="Swapping the staging tables took {seconds:.2f}s")
+        timer.start()
+        db.execute(text(f"DROP SCHEMA IF EXISTS {retired} CASCADE"))
+        db.execute(text(f"CREATE SCHEMA {retired}"))
+        db.commit()
+        sql = text(
+            "SELECT column_name, pg_get_serial_sequence('public.' || table_name,"
+            " column_name) AS sequence FROM information_schema.columns"
+            " WHERE table_schema = 'public' AND table_name = :table"
+            " AND is_identity = 'NO'"
+        )
+        tree = text(
+            "SELECT relname FROM pg_partition_tree(to_regclass(:table)) "
+            "JOIN pg_class ON pg_class.oid = relid WHERE level > 0"
+        )
+        for attempt in range(1, retries + 1):
+            try:
+                db.execute(text(f"SET LOCAL lock_timeout = '{timeout}'"))
+                for table in tables:
+                    live = f"public.{table}"
+                    # The staged tables use the ID sequences of the live ones,
+                    # so they mustn't be moved or dropped with the old table
+                    sequences = [
+                        (column, sequence)
+                        for column, sequence in db.execute(sql, {"table": table})
+                        if sequence is not None
+                    ]
+                    for _column, sequence in sequences:
+                        db.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+                    exists = text(f"SELECT to_regclass('{live}')")
+                    if db.execute(exists).scalar() is not None:
+                        old = db.execute(tree, {"table": live}).scalars().all()
+                        for name in [table] + old:
+                            move = f"ALTER TABLE public.{name} SET SCHEMA {retired}"
+                            db.execute(text(move))
+                    new = db.execute(tree, {"table": f"{schema}.{table}"})
+                    for name in [table] + new.scalars().all():
+                        move = f"ALTER TABLE {schema}.{name} SET SCHEMA public"
+                        db.execute(text(move))
+                    for column, sequence in sequences:
+                        owner = f'{live}."{column}"'
+                        db.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {owner}"))
+                db.commit()
+                break
+            except OperationalError as e:
+                # Most likely a long running query holds a lock on a table
+                db.rollback()
+                if attempt == retries:
+                    log.error(f"Couldn't swap the staging tables: {e}")
+                    raise
+                log.warning(f"Couldn't lock the tables, trying again: {e}")
+        timings["swap"] = timer.stop()
+
+        if not keep:
+            db.execute(text(f"DROP SCHEMA {retired} CASCADE"))
+        # Anything that wasn't moved, like a sequence, goes with the schema
+        db.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        db.commit()
+        self.schema = None
+        for db in self.connections:
+            searchPath(db)
+        # The writers in this process check again which tables are partitioned
+        forgetPartitions()
+
+        return timings
 
     def importOSM(
         self,
         infile: str,
-    ):
+        profile: dict = None,
+        style: str = f"{rootdir}/import/raw.lua",
+    ) -> dict:
         """Import an OSM data file into a postgres database.
 
         Args:
             infile (str): The file to import
+            profile (dict): The osm2pgsql settings, default is from osm2pgsqlProfile()
+            style (str): The flex style, for example one from FlexStyle.write()
+
         Returns:
-            (bool): Whether the import finished sucessfully
+            (dict): The stage timings and object counts from osm2pgsql
         """
         # osm2pgsql --create -d nigeria --extra-attributes --output=flex --style raw.lua nigeria-latest-internal.osm.pbf
+        if profile is None:
+            profile = osm2pgsqlProfile(infile)
+        log.info(f"Importing {infile} with {profile}")
+        options = [
+            "--create",
+            "--extra-attributes",
+            "--output=flex",
+            "--style",
+            style,
+            f"--cache={profile['cache']}",
+            f"--number-processes={profile['processes']}",
+        ]
+        if profile["slim"]:
+            options.append("--slim")
+        if profile["flat_nodes"]:
+            options.append(f"--flat-nodes={profile['flat_nodes']}")
+        if profile["drop"]:
+            options.append("--drop")
+        if self.schema is not None:
+            # osm2pgsql can't create unlogged tables, but keeps the live ones
+            options.append(f"--schema={self.schema}")
+
+        return self.osm2pgsql(options + [f"{infile}"])
+
+    def osm2pgsql(
+        self,
+        options: list,
+    ) -> dict:
+        """Run osm2pgsql on this database, logging its output as it runs.
+
+        Args:
+            options (list): The osm2pgsql command line options
+
+        Returns:
+            (dict): The stage timings and object counts from osm2pgsql
+        """
         uri = uriParser(self.dburi)
-        result = subprocess.run(
+        command = ["osm2pgsql", "-d", f"{uri['dbname']}"]
+        if uri["dbhost"] != "localhost":
+            command.append(f"--host={uri['dbhost']}")
+        if uri["dbport"]:
+            command.append(f"--port={uri['dbport']}")
+        if uri["dbuser"]:
+            command.append(f"--user={uri['dbuser']}")
+        env = dict(os.environ)
+        if uri["dbpass"]:
+            env["PGPASSWORD"] = uri["dbpass"]
+
+        lines = list()
+        process = subprocess.Popen(
+            command + options,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            text=True,
+        )
+        for line in process.stdout:
+            log.info(line.rstrip())
+            lines.append(line)
+        process.wait()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command + options)
+
+        return parseOsm2pgsql(lines)
+
+    def setReplication(
+        self,
+        source: str,
+        sequence: int,
+        timestamp: datetime = None,
+    ):
+        """Record the replication sequence the database is up to date with.
+
+        This is usually set from the state.txt of the extract after
+        importOSM(), so updateOSM() knows where to continue from.
+
+        Args:
+            source (str): The replication source, the directory of diffs
+            sequence (int): The sequence number of the last diff applied
+            timestamp (datetime): The timestamp of the last diff applied
+        """
+        sql = text(
+            "INSERT INTO replication_state (source, sequence, timestamp)"
+            " VALUES (:source, :sequence, :timestamp) ON CONFLICT (source)"
+            " DO UPDATE SET sequence = EXCLUDED.sequence,"
+            " timestamp = EXCLUDED.timestamp"
+        )
+        db = self.connections[0]
+        db.execute(
+            sql,
+            {
+                "source": str(Path(source).resolve()),
+                "sequence": sequence,
+                "timestamp": timestamp,
+            },
+        )
+        db.commit()
+
+    def updateOSM(
+        self,
+        directory: str,
+        flat_nodes: str = None,
+        style: str = f"{rootdir}/import/raw.lua",
+    ) -> list:
+        """Apply the OSM change files in a directory that are newer than the database.
+
+        The directory uses the replication layout, for example
+        000/123/456.osc.gz with an optional 000/123/456.state.txt. The
+        database must have been imported in slim mode without --drop.
+        The changes can't be staged, as they update the live tables.
+
+        Args:
+            directory (str): The directory of .osc.gz files
+            flat_nodes (str): The flat nodes file used by the import, if any
+            style (str): The flex style used by the import
+
+        Returns:
+            (list): The osm2pgsql result for each change file applied
+        """
+        if self.schema is not None:
+            msg = "Change files can't be applied to staging tables"
+            log.error(msg)
+            raise ValueError(msg)
+        source = str(Path(directory).resolve())
+        db = self.connections[0]
+        sql = text("SELECT sequence FROM replication_state WHERE source = :source")
+        current = db.execute(sql, {"source": source}).scalar()
+        db.commit()
+        if current is None:
+            msg = f"No replication state for {directory}, use setReplication() first"
+            log.error(msg)
+            raise ValueError(msg)
+
+        changes = sorted(
             [
-                "osm2pgsql",
-                "--create",
-                "-d",
-                f"{uri['dbname']}",
+                (sequence, path)
+                for sequence, path in readChanges(directory)
+                if sequence > current
+            ]
+        )
+        log.info(f"Applying {len(changes)} change files after sequence {current}")
+        results = list()
+        for sequence, path in changes:
+            options = [
+                "--append",
+                "--slim",
                 "--extra-attributes",
                 "--output=flex",
                 "--style",
-                f"{rootdir}/import/raw.lua",
-                f"{infile}",
+                style,
             ]
-        )
-        result.check_returncode()
+            if flat_nodes:
+                options.append(f"--flat-nodes={flat_nodes}")
+            results.append(self.osm2pgsql(options + [str(path)]))
+            state = readState(path)
+            self.setReplication(directory, sequence, state.get("timestamp"))
+
+        return results
 
     def importParquet(
         self,
         infile: str,
+        workers: int = cores,
+        groups: int = 1,
+        defer: bool = False,
+        cluster: bool = False,
+        sort: bool = False,
+        merge: bool = False,
+        dedup: bool = False,
+        aoi=None,
+        exclude: tuple = SKIPPED_DATASETS,
     ):
-        """Import an Overture parquet data file into a postgres database.
+        """Import Overture parquet data into a postgres database.
+
+        The input can be a single file, or a dataset directory or glob
+        of them. The row groups of every file are split into work units,
+        which are imported by a single pool of worker processes that
+        each own a database connection, so the number of processes and
+        connections doesn't depend on the number of files. With an AOI,
+        the row groups that don't overlap it aren't read, and only the
+        features whose bbox overlaps it are imported.
 
         Args:
-            infile (str): The file to import
+            infile (str): The parquet file, dataset directory, or glob to import
+            workers (int): The number of worker processes
+            groups (int): The number of row groups in each work unit
+            defer (bool): Whether to drop the indexes and rebuild them after loading
+            cluster (bool): Whether to cluster ways_poly after rebuilding the indexes
+            sort (bool): Whether to sort each row group along a Hilbert curve
+            merge (bool): Whether to update features that are already imported
+            dedup (bool): Whether to skip buildings that duplicate OSM ones
+            aoi (tuple, Geometry): The area of interest, a shapely geometry
+                or its (xmin, ymin, xmax, ymax) bounds
+            exclude (tuple): The Overture datasets to skip, like OpenStreetMap
 
         Returns:
             (bool): Whether the import finished sucessfully
@@ -313,100 +1399,852 @@ class MapImporter(object):
         # spin = PixelSpinner(f"Processing {infile}...")
         timer = Timer(text="importParquet() took {seconds:.0f}s")
         timer.start()
-        overture = Overture(infile)
-
-        connections = list()
-        for thread in range(0, cores + 1):
-            engine = create_engine(f"postgresql://{self.dburi}", echo=False)
-            if not database_exists(engine.url):
-                create_database(engine.url)
-            connections.append(engine.connect())
-            sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-            if thread == 0:
-                meta = MetaData()
-                meta.create_all(engine)
-
-        # A chunk is a group of threads
-        entries = len(overture.data)
-        log.debug(f"There are {entries} entries in {infile}")
-        chunk = round(entries / cores)
-
-        if entries <= chunk:
-            result = parquetThread(overture.data, connections[0])
-            timer.stop()
-            return True
+        if aoi is not None and not isinstance(aoi, tuple):
+            aoi = tuple(aoi.bounds)
+        files = datasetFiles(infile)
+        units = list()
+        for path in files:
+            overture = Overture(path, aoi)
+            if overture.pfile is None:
+                return False
+            matching = overture.matchingGroups()
+            units.extend(
+                [
+                    (path, matching[index : index + groups])
+                    for index in range(0, len(matching), groups)
+                ]
+            )
+        if len(files) == 0:
+            return False
+        if merge:
+            self.prepareMerge()
+        if defer and dedup:
+            log.warning("Finding duplicates needs the indexes, so they're not deferred")
+            defer = False
+        if defer:
+            indexes = self.dropIndexes()
+
+        # The work units left, and the rows written, for each file
+        progress = {path: [0, 0] for path, unit in units}
+        for path, _unit in units:
+            progress[path][0] += 1
+
+        def done(path: str, count: int):
+            progress[path][0] -= 1
+            progress[path][1] += count
+            if progress[path][0] == 0:
+                finished = [left for left, written in progress.values()].count(0)
+                log.info(
+                    f"Imported {progress[path][1]} rows from {path}, "
+                    f"{finished} of {len(progress)} files done"
+                )
 
-        index = 0
-        with concurrent.futures.ProcessPoolExecutor(max_workers=cores) as executor:
-            block = 0
-            while block <= entries:
-                if len(overture.data[block : block + chunk]) == 0:
-                    continue
-                log.debug("Dispatching Block %d:%d" % (block, block + chunk))
-                result = executor.submit(
-                    parquetThread,
-                    overture.data[block : block + chunk],
-                    connections[index],
+        # Only one row group is read into memory at a time
+        rows = 0
+        if workers > 1 and len(units) > 1:
+            workers = self._processWorkers(workers)
+        if workers <= 1 or len(units) <= 1:
+            for path, unit in units:
+                count = parquetWorker(
+                    path, unit, self.connections[0], sort, merge, dedup, aoi, exclude
                 )
-                block += chunk
-                index += 1
-            executor.shutdown()
+                done(path, count)
+                rows += count
+        else:
+            log.debug(f"Dispatching {len(units)} work units to {workers} workers")
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=workerInit,
+                initargs=(self.dburi, self.schema),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        parquetWorker,
+                        path,
+                        unit,
+                        None,
+                        sort,
+                        merge,
+                        dedup,
+                        aoi,
+                        exclude,
+                    ): path
+                    for path, unit in units
+                }
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        count = future.result()
+                        done(futures[future], count)
+                        rows += count
+                except Exception:
+                    executor.shutdown(cancel_futures=True)
+                    raise
         timer.stop()
+        log.info(f"Imported {rows} rows at {rows / timer.last:.0f} rows/sec")
+        if defer:
+            self.createIndexes(indexes, cluster=cluster)
+
+        return True
+
+    def importPipeline(
+        self,
+        items,
+        convert,
+        converters: int = cores,
+        writers: int = cores,
+        processes: bool = True,
+        sort: bool = False,
+        merge: bool = False,
+    ) -> int:
+        """Import work units through a pipeline of converters and writers.
+
+        The caller reads the input, the converter workers turn each
+        work unit into the data to COPY, and the writer threads each
+        own a database connection. The stages are joined by bounded
+        queues, so reading, converting, and writing overlap without
+        the memory use growing. Any input format can be imported by
+        supplying a reader and a function like convertGeoJson().
+
+        Args:
+            items (iterable): The work unit for the import ledger and the data
+            convert (callable): The function to convert an item to a batch,
+                it must be a module level function when processes is True
+            converters (int): The number of converter workers
+            writers (int): The number of writer threads
+            processes (bool): Whether the converters are processes or threads
+            sort (bool): Whether to sort each batch along a Hilbert curve
+            merge (bool): Whether to merge the rows on their source ID
+
+        Returns:
+            (int): The number of rows written
+        """
+        # The first connection is left for the caller, for example to
+        # allocate IDs while the writers are running
+        connections = self.connect(writers + 1)[1:]
+        pipeline = Pipeline()
+        pipeline.addStage(
+            functools.partial(convert, sort=sort, merge=merge),
+            converters,
+            processes,
+            name="convert",
+        )
+        pipeline.addStage(
+            writeBatch,
+            len(connections),
+            args=[(db, merge) for db in connections],
+            name="write",
+        )
+
+        return sum(pipeline.run(items))
 
     def importGeoJson(
         self,
         infile: str,
+        batch: int = 10000,
+        defer: bool = False,
+        cluster: bool = False,
+        sort: bool = False,
+        converters: int = cores,
+        writers: int = cores,
+        merge: bool = False,
     ):
-        """Import a GeoJson data file into a postgres database.
+        """Import a GeoJson or GeoJsonSeq data file into a postgres database.
+
+        The file is parsed incrementally, and batches of features are
+        passed through a pipeline of converter processes and writer
+        threads, so memory use doesn't depend on the size of the file.
+        A GeoJsonSeq file is instead split into a byte range for each
+        converter, which is decoded and written by its own process.
 
         Args:
             infile (str): The file to import
+            batch (int): The number of features in each batch
+            defer (bool): Whether to drop the indexes and rebuild them after loading
+            cluster (bool): Whether to cluster ways_poly after rebuilding the indexes
+            sort (bool): Whether to sort each batch along a Hilbert curve
+            converters (int): The number of converter processes
+            writers (int): The number of writer threads
+            merge (bool): Whether to update features that are already imported
 
         Returns:
             (bool): Whether the import finished sucessfully
         """
-        # load the GeoJson file
-        file = open(infile, "r")
-        # size = os.path.getsize(infile)
-        # for line in file.readlines():
-        #    print(line)
-        data = geojson.load(file)
-
-        future = None
-        result = None
-        index = 0
-        connections = list()
-
+        if merge:
+            self.prepareMerge()
+        if defer:
+            indexes = self.dropIndexes()
         timer = Timer(text="importGeoJson() took {seconds:.0f}s")
         timer.start()
-
-        # A chunk is a group of threads
-        entries = len(data["features"])
-        chunk = round(entries / cores)
-
-        # For small files we only need one thread
-        if entries <= chunk:
-            result = importThread(data["features"], self.connections[0])
+        if Path(infile).suffix in SEQUENCES and converters > 1:
+            rows = self.importRanges(infile, converters, batch, sort, merge)
             timer.stop()
+            log.info(f"Imported {rows} rows at {rows / timer.last:.0f} rows/sec")
+            if defer:
+                self.createIndexes(indexes, cluster=cluster)
+
             return True
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=cores) as executor:
-            block = 0
-            while block <= entries:
-                log.debug("Dispatching Block %d:%d" % (block, block + chunk))
-                result = executor.submit(
-                    importThread,
-                    data["features"][block : block + chunk],
-                    self.connections[index],
-                )
-                block += chunk
-                index += 1
-            executor.shutdown()
+        source = str(Path(infile).resolve())
+        # The writers don't use the first connection
+        ids = IdAllocator(self.connections[0])
+
+        def read():
+            start = 0
+            for features in readGeoJson(infile, batch):
+                end = start + len(features)
+                unit = {"source": source, "unit": f"features:{start}-{end}"}
+                yield (unit, features, ids.allocate(len(features)))
+                start = end
+
+        rows = self.importPipeline(
+            read(), convertGeoJson, converters, writers, sort=sort, merge=merge
+        )
         timer.stop()
+        log.info(f"Imported {rows} rows at {rows / timer.last:.0f} rows/sec")
+        if defer:
+            self.createIndexes(indexes, cluster=cluster)
 
         return True
 
+    def importRanges(
+        self,
+        infile: str,
+        workers: int = cores,
+        batch: int = 10000,
+        sort: bool = False,
+        merge: bool = False,
+    ) -> int:
+        """Import a GeoJsonSeq file split into byte ranges by worker processes.
+
+        Each worker decodes the lines in its range of the file, and
+        writes them with its own database connection, so decoding the
+        JSON isn't limited to one core. Resuming an import needs the
+        same number of workers and batch size.
+
+        Args:
+            infile (str): The GeoJsonSeq file
+            workers (int): The number of worker processes
+            batch (int): The number of features in each batch
+            sort (bool): Whether to sort each batch along a Hilbert curve
+            merge (bool): Whether to merge the features on their source ID
+
+        Returns:
+            (int): The number of rows written
+        """
+        workers = self._processWorkers(workers)
+        ranges = splitLines(infile, workers)
+        log.debug(f"Dispatching {len(ranges)} byte ranges to {workers} workers")
+        rows = 0
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=len(ranges),
+            initializer=workerInit,
+            initargs=(self.dburi, self.schema),
+        ) as executor:
+            futures = [
+                executor.submit(sequenceWorker, infile, start, end, batch, sort, merge)
+                for start, end in ranges
+            ]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    rows += future.result()
+            except Exception:
+                executor.shutdown(cancel_futures=True)
+                raise
+
+        return rows
+
+    def prepareMerge(self):
+        """Add the source ID and content hash columns used to merge imports.
+
+        The unique index on the source ID is what INSERT ... ON CONFLICT
+        uses to find the existing rows, so it's kept when the other
+        indexes are deferred. It can't be created on a partitioned table.
+        """
+        db = self.connections[0]
+        sql = text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)")
+        for table in TABLES:
+            if db.execute(sql, {"table": table}).scalar() == "p":
+                msg = f"{table} is partitioned, so features can't be merged"
+                log.error(msg)
+                raise ValueError(msg)
+        for table in TABLES:
+            sql = (
+                f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS source_id text,"
+                " ADD COLUMN IF NOT EXISTS hash text"
+            )
+            db.execute(text(sql))
+            sql = (
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_source_id_idx"
+                f" ON {table} (source_id)"
+            )
+            db.execute(text(sql))
+        db.commit()
+
+    def convertRefs(self) -> list:
+        """Convert the refs of the ways to a bigint[] where they're text.
+
+        The raw.lua style writes the node IDs of each way as a bigint[],
+        but the tables in older databases, like those loaded from the
+        SQL files, have them as text, which is bigger on disk and has to
+        be parsed by every extract. This rewrites those tables.
+
+        Returns:
+            (list): The tables that were converted
+        """
+        db = self.connections[0]
+        converted = list()
+        for table in ("ways_line", "ways_poly"):
+            sql = text(
+                "SELECT data_type FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = :table"
+                " AND column_name = 'refs'"
+            )
+            kind = db.execute(sql, {"table": table}).scalar()
+            if kind is None:
+                sql = f"ALTER TABLE {table} ADD COLUMN refs bigint[]"
+            elif kind == "text":
+                sql = (
+                    f"ALTER TABLE {table} ALTER COLUMN refs TYPE bigint[]"
+                    " USING refs::bigint[]"
+                )
+            else:
+                continue
+            db.execute(text(sql))
+            db.commit()
+            converted.append(table)
+            log.info(f"The refs of {table} are now a bigint[]")
+
+        return converted
+
+    def analyzeTables(
+        self,
+        configs: list = None,
+        target: int = STATISTICS_TARGET,
+        freeze: bool = True,
+        memory: str = "1GB",
+    ) -> dict:
+        """Vacuum and analyze the tables after an import.
+
+        Until the tables are analyzed the planner guesses how many rows
+        match a tag, and autovacuum later has to freeze every row that
+        was imported. Statistics are created on the tags the query
+        configs filter on, with a raised target, and then each table, or
+        each partition of a partitioned table, is vacuumed and analyzed
+        in parallel. How far off the planner's row estimate for each tag
+        filter was is logged before and after.
+
+        Args:
+            configs (list): The QueryConfigs, or the YAML or JSON files to parse
+            target (int): The statistics target for the tags
+            freeze (bool): Whether to freeze the rows while vacuuming
+            memory (str): The maintenance_work_mem for each vacuum
+
+        Returns:
+            (dict): The time each phase took, and the estimates for each tag filter
+        """
+        db = self.connections[0]
+        timings = dict()
+        tables = list()
+        for table in TABLES + ("relations",):
+            sql = text("SELECT to_regclass(:table)")
+            if db.execute(sql, {"table": table}).scalar() is not None:
+                tables.append(table)
+        sql = text(
+            "SELECT relid::text FROM pg_partition_tree(:table)"
+            " WHERE isleaf ORDER BY relid"
+        )
+        # A table that isn't partitioned has no partition tree
+        leaves = {
+            table: db.execute(sql, {"table": table}).scalars().all() or [table]
+            for table in tables
+        }
+        predicates = tagPredicates(configs or list())
+        filters = [
+            (table, key, tagPredicate(key, values))
+            for table in tables
+            if table in predicates
+            for key, values in predicates[table]
+        ]
+
+        estimates = list()
+        for table in tables:
+            where = [predicate for name, key, predicate in filters if name == table]
+            if len(where) == 0:
+                continue
+            # All the tag filters are counted in one scan of the table
+            counts = ", ".join([f"count(*) FILTER (WHERE {sql})" for sql in where])
+            actual = db.execute(text(f"SELECT {counts} FROM {table}")).one()
+            for predicate, rows in zip(where, actual, strict=True):
+                estimates.append(
+                    {
+                        "table": table,
+                        "predicate": predicate,
+                        "rows": rows,
+                        "before": self._estimate(table, predicate),
+                    }
+                )
+        db.commit()
+
+        timer = Timer(text="Creating statistics took {seconds:.0f}s")
+        timer.start()
+        version = int(db.execute(text("SHOW server_version_num")).scalar())
+        if version < 140000 and len(filters) > 0:
+            log.warning("Statistics on the tags need postgres 14 or newer")
+        elif len(filters) > 0:
+            for table, key, _predicate in filters:
+                expression = "tags->>'" + key.replace("'", "''") + "'"
+                digest = hashlib.md5(key.encode()).hexdigest()[:8]
+                label = re.sub(r"\W", "_", key)[:20]
+                for leaf in leaves[table]:
+                    name = f"{leaf.split('.')[-1]}_{label}_{digest}_stats"
+                    sql = (
+                        f"CREATE STATISTICS IF NOT EXISTS {name}"
+                        f" ON ({expression}) FROM {leaf}"
+                    )
+                    db.execute(text(sql))
+                    db.execute(text(f"ALTER STATISTICS {name} SET STATISTICS {target}"))
+            db.commit()
+        timings["statistics"] = timer.stop()
+
+        timer = Timer(text="Vacuuming took {seconds:.0f}s")
+        timer.start()
+        units = [(leaf,) for table in tables for leaf in leaves[table]]
+        options = "FREEZE, ANALYZE" if freeze else "ANALYZE"
+
+        def vacuum(db: Connection, table: str):
+            db.commit()
+            try:
+                # VACUUM can't run inside a transaction
+                db.execution_options(isolation_level="AUTOCOMMIT")
+                db.execute(text(f"SET maintenance_work_mem = '{memory}'"))
+                db.execute(text(f"VACUUM ({options}) {table}"))
+            finally:
+                # Ends the transaction object, which does nothing in autocommit
+                db.commit()
+                db.execution_options(isolation_level=db.default_isolation_level)
+
+        self._runPooled(vacuum, units)
+        timings["vacuum"] = timer.stop()
+
+        db = self.connections[0]
+        for estimate in estimates:
+            estimate["after"] = self._estimate(estimate["table"], estimate["predicate"])
+            before = estimateError(estimate["before"], estimate["rows"])
+            after = estimateError(estimate["after"], estimate["rows"])
+            log.info(
+                f"{estimate['table']} {estimate['predicate']}: "
+                f"{estimate['rows']} rows, estimated "
+                f"{estimate['before']:.0f} ({before:.1f}x) before and "
+                f"{estimate['after']:.0f} ({after:.1f}x) after"
+            )
+        db.commit()
+        if len(estimates) > 0:
+            before = max([estimateError(e["before"], e["rows"]) for e in estimates])
+            after = max([estimateError(e["after"], e["rows"]) for e in estimates])
+            log.info(f"The worst row estimate was off {before:.1f}x, now {after:.1f}x")
+
+        return {"timings": timings, "estimates": estimates}
+
+    def _estimate(
+        self,
+        table: str,
+        predicate: str,
+    ) -> float:
+        """Get the rows the planner estimates a filter on a table matches.
+
+        Args:
+            table (str): The table
+            predicate (str): The SQL for the WHERE clause
+
+        Returns:
+            (float): The estimated number of rows
+        """
+        sql = f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {table} WHERE {predicate}"
+        plan = self.connections[0].execute(text(sql)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return plan[0]["Plan"]["Plan Rows"]
+
+    def loadCountries(
+        self,
+        boundaries: str = None,
+    ) -> int:
+        """Load the country boundaries used by assignCountries().
+
+        The boundaries are split into small pieces, as the spatial join
+        only has to test the pieces whose bounding box a feature is in.
+
+        Args:
+            boundaries (str): A GeoJson file of boundaries, the default is
+                the admin_level 2 relations in the relations table
+
+        Returns:
+            (int): The number of countries
+        """
+        db = self.connections[0]
+        sql = (
+            "DROP TABLE IF EXISTS countries;"
+            " CREATE TABLE countries (id integer, name text,"
+            " geom geometry(Geometry,4326))"
+        )
+        db.execute(text(sql))
+        if boundaries is None:
+            sql = text(
+                "INSERT INTO countries (id, name, geom)"
+                " SELECT osm_id, tags->>'name', ST_Subdivide(geom, :vertices)"
+                " FROM relations WHERE tags->>'boundary' = 'administrative'"
+                " AND tags->>'admin_level' = '2' AND ST_Dimension(geom) = 2"
+            )
+            db.execute(sql, {"vertices": COUNTRY_VERTICES})
+        else:
+            sql = text(
+                "INSERT INTO countries (id, name, geom) SELECT :id, :name,"
+                " ST_Subdivide(ST_GeomFromEWKT(:geom), :vertices)"
+            )
+            for index, features in enumerate(readGeoJson(boundaries, 1)):
+                feature = features[0]
+                properties = feature.get("properties") or dict()
+                country = properties.get("id") or feature.get("id") or index + 1
+                db.execute(
+                    sql,
+                    {
+                        "id": int(country),
+                        "name": properties.get("name"),
+                        "geom": f"SRID=4326;{shape(feature['geometry']).wkt}",
+                        "vertices": COUNTRY_VERTICES,
+                    },
+                )
+        sql = "CREATE INDEX countries_geom_idx ON countries USING gist (geom)"
+        db.execute(text(sql))
+        db.execute(text("ANALYZE countries"))
+        count = db.execute(text("SELECT count(DISTINCT id) FROM countries")).scalar()
+        db.commit()
+        log.info(f"Loaded {count} countries")
+
+        return count
+
+    def assignCountries(
+        self,
+        boundaries: str = None,
+        workers: int = cores,
+        chunk: int = 100000,
+        incremental: bool = False,
+    ) -> dict:
+        """Set the country column of the raw data tables.
+
+        The country is the IDs of the boundaries a feature intersects,
+        or an empty array if it's in none of them. Each table is split
+        into disjoint ranges of IDs, and the ranges are updated in
+        parallel with a spatial join, each in its own transaction.
+
+        Args:
+            boundaries (str): A GeoJson file of boundaries, the default is
+                the admin_level 2 relations in the relations table
+            workers (int): The number of ranges updated at the same time
+            chunk (int): The average number of rows in each range
+            incremental (bool): Whether to only update the rows without a
+                country, like those added by updateOSM()
+
+        Returns:
+            (dict): The number of rows updated in each table
+        """
+        timer = Timer(text="Assigning countries took {seconds:.0f}s")
+        timer.start()
+        db = self.connections[0]
+        loaded = db.execute(text("SELECT to_regclass('countries')")).scalar()
+        if boundaries is not None or not incremental or loaded is None:
+            self.loadCountries(boundaries)
+
+        jobs = list()
+        for table in TABLES + ("relations",):
+            if db.execute(text(f"SELECT to_regclass('{table}')")).scalar() is None:
+                continue
+            sql = f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS country integer[]"
+            db.execute(text(sql))
+            sql = text(
+                "SELECT column_name FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = :table"
+            )
+            columns = db.execute(sql, {"table": table}).scalars().all()
+            key = "id" if "id" in columns else "osm_id"
+            where = "WHERE country IS NULL" if incremental else ""
+            sql = f"SELECT min({key}), max({key}), count(*) FROM {table} {where}"
+            first, last, rows = db.execute(text(sql)).one()
+            db.commit()
+            if rows == 0:
+                continue
+            # The IDs aren't dense, so this only roughly evens out the ranges
+            ranges = max(workers, rows // chunk, 1)
+            step = (last - first) // ranges + 1
+            for start in range(first, last + 1, step):
+                jobs.append((table, key, start, start + step - 1))
+
+        def update(db: Connection, table: str, key: str, start: int, end: int) -> int:
+            where = "AND f.country IS NULL" if incremental else ""
+            # Features in no country get an empty array, so an incremental
+            # update doesn't check them again
+            sql = (
+                f"UPDATE {table} AS t SET country = found.country"
+                f" FROM (SELECT f.{key} AS key,"
+                " array_remove(array_agg(DISTINCT c.id ORDER BY c.id), NULL)"
+                f" AS country FROM {table} AS f LEFT JOIN countries AS c"
+                " ON ST_Intersects(c.geom, f.geom)"
+                f" WHERE f.{key} BETWEEN :start AND :end {where}"
+                f" GROUP BY f.{key}) AS found"
+                f" WHERE t.{key} = found.key AND t.{key} BETWEEN :start AND :end"
+            )
+            result = db.execute(text(sql), {"start": start, "end": end})
+            db.commit()
+
+            return result.rowcount
+
+        result = {table: 0 for table, key, start, end in jobs}
+        log.debug(f"Assigning countries in {len(jobs)} ID ranges")
+        for job, rows in zip(jobs, self._runPooled(update, jobs, workers), strict=True):
+            result[job[0]] += rows
+        timer.stop()
+        for table, rows in result.items():
+            log.info(f"Assigned the country of {rows} rows in {table}")
+
+        return result
+
+    def partitionTables(self) -> dict:
+        """Partition the raw data tables on their grid cell.
+
+        Each table becomes a parent partitioned by list on the grid
+        column, with a partition for each grid cell that has data, and
+        a default partition. The importers create the partitions for
+        new cells as they write them. Rows added by osm2pgsql in a new
+        cell go into the default partition, running this again moves
+        them into their own partitions.
+
+        Unique indexes, like the primary key and the source ID used by
+        merge mode, can't be kept, as they don't include the grid.
+
+        Returns:
+            (dict): The number of grid cells in each table
+        """
+        timer = Timer(text="Partitioning took {seconds:.0f}s")
+        timer.start()
+        db = self.connections[0]
+        result = dict()
+        for table in TABLES:
+            sql = f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS grid integer"
+            db.execute(text(sql))
+            sql = (
+                f"UPDATE {table} SET grid = {gridSql()}"
+                " WHERE grid IS NULL AND geom IS NOT NULL"
+            )
+            db.execute(text(sql))
+            sql = text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)")
+            if db.execute(sql, {"table": table}).scalar() == "p":
+                self._splitDefault(table)
+            else:
+                self._partition(table)
+            db.commit()
+            sql = text(
+                "SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass(:table)"
+            )
+            # Don't count the default partition
+            result[table] = db.execute(sql, {"table": table}).scalar() - 1
+            db.commit()
+            log.info(f"{table} has {result[table]} grid cells")
+        # The writers in this process check again which tables are partitioned
+        forgetPartitions()
+        timer.stop()
+
+        return result
+
+    def _columns(
+        self,
+        table: str,
+    ) -> list:
+        """Get the columns of a table that aren't generated.
+
+        Args:
+            table (str): The table
+
+        Returns:
+            (list): The name of each column, and its sequence if it has one
+        """
+        sql = text(
+            "SELECT column_name, pg_get_serial_sequence(:table, column_name)"
+            " FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND table_name = :table"
+            " AND is_generated = 'NEVER' ORDER BY ordinal_position"
+        )
+
+        return self.connections[0].execute(sql, {"table": table}).all()
+
+    def _partition(
+        self,
+        table: str,
+    ):
+        """Replace a table with one partitioned on the grid cell.
+
+        Args:
+            table (str): The table to partition
+        """
+        db = self.connections[0]
+        old = f"{table}_unpartitioned"
+        sql = text(
+            "SELECT indexdef FROM pg_indexes"
+            " WHERE schemaname = current_schema() AND tablename = :table"
+            " AND indexdef NOT LIKE 'CREATE UNIQUE%'"
+        )
+        indexes = db.execute(sql, {"table": table}).scalars().all()
+        columns = self._columns(table)
+        names = ", ".join([f'"{column}"' for column, sequence in columns])
+
+        db.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        sql = (
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS"
+            " INCLUDING GENERATED INCLUDING STORAGE) PARTITION BY LIST (grid)"
+        )
+        db.execute(text(sql))
+        # Keep the ID sequences when the old table is dropped
+        for column, sequence in columns:
+            if sequence is not None:
+                sql = f'ALTER SEQUENCE {sequence} OWNED BY {table}."{column}"'
+                db.execute(text(sql))
+        sql = f"SELECT DISTINCT grid FROM {old} WHERE grid IS NOT NULL"
+        for cell in db.execute(text(sql)).scalars().all():
+            sql = (
+                f"CREATE TABLE {table}_grid_{cell} PARTITION OF {table}"
+                f" FOR VALUES IN ({cell})"
+            )
+            db.execute(text(sql))
+        sql = f"CREATE TABLE {table}_grid_default PARTITION OF {table} DEFAULT"
+        db.execute(text(sql))
+        db.execute(text(f"INSERT INTO {table} ({names}) SELECT {names} FROM {old}"))
+        db.execute(text(f"DROP TABLE {old}"))
+        # The indexes are created on each partition
+        for sql in indexes:
+            db.execute(text(sql))
+
+    def _splitDefault(
+        self,
+        table: str,
+    ):
+        """Move the rows in the default partition into their own partitions.
+
+        Args:
+            table (str): The partitioned table
+        """
+        db = self.connections[0]
+        default = f"{table}_grid_default"
+        names = ", ".join([f'"{column}"' for column, sequence in self._columns(table)])
+        sql = f"SELECT DISTINCT grid FROM {default} WHERE grid IS NOT NULL"
+        for cell in db.execute(text(sql)).scalars().all():
+            name = f"{table}_grid_{cell}"
+            sql = (
+                f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS"
+                " INCLUDING GENERATED INCLUDING STORAGE)"
+            )
+            db.execute(text(sql))
+            sql = (
+                f"WITH moved AS (DELETE FROM {default} WHERE grid = {cell}"
+                f" RETURNING {names}) INSERT INTO {name} ({names})"
+                f" SELECT {names} FROM moved"
+            )
+            db.execute(text(sql))
+            sql = f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES IN ({cell})"
+            db.execute(text(sql))
+
+    def dropIndexes(self) -> list:
+        """Drop the secondary indexes on the raw data tables before a bulk load.
+
+        Duplicate indexes are only kept once, and a GiST index on the
+        geometry and centroid and a GIN index on the tags are added if
+        a table lacks them.
+
+        Returns:
+            (list): The SQL to recreate the indexes
+        """
+        timer = Timer(text="Dropping indexes took {seconds:.0f}s")
+        timer.start()
+        db = self.connections[0]
+        indexes = list()
+        for table in TABLES:
+            sql = text(
+                "SELECT indexname, indexdef FROM pg_indexes"
+                " WHERE schemaname = current_schema() AND tablename = :table"
+                " AND indexdef NOT LIKE 'CREATE UNIQUE%'"
+            )
+            methods = set()
+            names = set()
+            for name, indexdef in db.execute(sql, {"table": table}).all():
+                method = indexMethod(indexdef)
+                if method not in methods:
+                    # On a partitioned table the index is ON ONLY the parent,
+                    # which would leave it invalid without the partitions
+                    indexes.append(re.sub(" ON ONLY ", " ON ", indexdef, count=1))
+                    methods.add(method)
+                    names.add(name)
+                db.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+            sql = text(
+                "SELECT column_name FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = :table"
+            )
+            columns = db.execute(sql, {"table": table}).scalars().all()
+            for column, using in INDEXES.items():
+                name = f"{table}_{column}_idx"
+                if column not in columns or name in names:
+                    continue
+                if f"{using} ({column})" not in methods:
+                    sql = f"CREATE INDEX {name} ON {table}"
+                    indexes.append(f"{sql} USING {using} ({column})")
+        db.commit()
+        timer.stop()
+
+        return indexes
+
+    def createIndexes(
+        self,
+        indexes: list,
+        memory: str = "1GB",
+        cluster: bool = False,
+    ) -> dict:
+        """Build the indexes in parallel after a bulk load.
+
+        Args:
+            indexes (list): The SQL to create each index
+            memory (str): The maintenance_work_mem for each index build
+            cluster (bool): Whether to cluster ways_poly on the geometry index
+
+        Returns:
+            (dict): The time in seconds each phase took
+        """
+        timings = dict()
+        timer = Timer(text="Building indexes took {seconds:.0f}s")
+        timer.start()
+
+        def build(db: Connection, sql: str):
+            db.execute(text(f"SET maintenance_work_mem = '{memory}'"))
+            db.execute(text(sql))
+            db.commit()
+
+        self._runPooled(build, [(sql,) for sql in indexes])
+        timings["index"] = timer.stop()
+
+        if cluster:
+            timer = Timer(text="Clustering ways_poly took {seconds:.0f}s")
+            timer.start()
+            db = self.connections[0]
+            sql = text(
+                "SELECT indexname FROM pg_indexes"
+                " WHERE schemaname = current_schema() AND tablename = 'ways_poly'"
+                " AND indexdef LIKE '%USING gist (geom)%'"
+            )
+            index = db.execute(sql).scalar()
+            db.execute(text(f"SET maintenance_work_mem = '{memory}'"))
+            db.execute(text(f'CLUSTER ways_poly USING "{index}"'))
+            db.commit()
+            timings["cluster"] = timer.stop()
+
+        return timings
+
 
 def main():
     """This main function lets this class be run standalone by a bash script."""
@@ -421,6 +2259,47 @@ def main():
     parser.add_argument("-v", "--verbose", nargs="?", const="0", help="verbose output")
     parser.add_argument("-i", "--infile", required=True, help="Input data file")
     parser.add_argument("-u", "--uri", required=True, help="Database URI")
+    parser.add_argument(
+        "-s",
+        "--style",
+        default=f"{rootdir}/import/raw.lua",
+        help="osm2pgsql flex style",
+    )
+    parser.add_argument(
+        "-m", "--merge", action="store_true", help="Update existing features"
+    )
+    parser.add_argument(
+        "-c",
+        "--countries",
+        nargs="?",
+        const="",
+        help="Assign countries, from a GeoJson file or the boundary relations",
+    )
+    parser.add_argument(
+        "-b", "--boundary", help="Only import the Overture data in this GeoJson AOI"
+    )
+    parser.add_argument(
+        "-x",
+        "--exclude",
+        nargs="*",
+        help=f"Skip these Overture datasets, default is {', '.join(SKIPPED_DATASETS)}",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Skip Overture buildings that duplicate OSM buildings",
+    )
+    parser.add_argument(
+        "--stage",
+        action="store_true",
+        help="Import into staging tables, then swap them with the live tables",
+    )
+    parser.add_argument(
+        "-a",
+        "--analyze",
+        nargs="*",
+        help="Vacuum and analyze after importing, with the tags in these query configs",
+    )
     args = parser.parse_args()
 
     if len(argv) <= 1:
@@ -442,19 +2321,54 @@ def main():
     mi = MapImporter(args.uri)
 
     path = Path(args.infile)
+    updates = path.is_dir() and len(readChanges(args.infile)) > 0
+    aoi = None
+    if args.boundary:
+        with open(args.boundary, "r") as file:
+            boundary = json.load(file)
+        features = boundary.get("features", [boundary])
+        aoi = GeometryCollection(
+            [shape(feature.get("geometry", feature)) for feature in features]
+        )
+    exclude = SKIPPED_DATASETS
+    if args.exclude is not None:
+        exclude = tuple(args.exclude)
+    if args.stage and updates:
+        parser.error("--stage can't be used with a directory of change files")
+    if args.stage:
+        mi.createStaging()
 
     # And populate it with data
-    if path.suffix == ".osm" or path.suffix == ".pbf":
-        mi.importOSM(args.infile)
-    elif path.suffix == ".geojson":
-        mi.importGeoJson(args.infile)
+    if updates:
+        # A directory of replication diffs
+        mi.updateOSM(args.infile, style=args.style)
+    elif path.is_dir() or "*" in args.infile:
+        # A directory or glob of Overture parquet files
+        mi.importParquet(
+            args.infile, merge=args.merge, dedup=args.dedup, aoi=aoi, exclude=exclude
+        )
+    elif path.suffix == ".osm" or path.suffix == ".pbf":
+        mi.importOSM(args.infile, style=args.style)
+    elif path.suffix == ".geojson" or path.suffix in SEQUENCES:
+        mi.importGeoJson(args.infile, merge=args.merge)
     elif path.suffix == ".parquet":
         # Newer data from Overture has a suffix
-        mi.importParquet(args.infile)
+        mi.importParquet(
+            args.infile, merge=args.merge, dedup=args.dedup, aoi=aoi, exclude=exclude
+        )
     else:
         # Older data from Overture lacked the suffix
-        mi.importParquet(args.infile)
+        mi.importParquet(
+            args.infile, merge=args.merge, dedup=args.dedup, aoi=aoi, exclude=exclude
+        )
     log.info(f"Imported {args.infile} into {args.uri}")
+    if args.countries is not None:
+        mi.assignCountries(args.countries or None, incremental=updates)
+    if args.stage:
+        # The live tables must survive a crash, and be replicated
+        mi.swapStaging(logged=True)
+    if args.analyze is not None:
+        mi.analyzeTables(args.analyze)
 
 
 if __name__ == "__main__":
@@ -16,12 +16,21 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import glob
+import hashlib
 import logging
 import math
 import sys
+from pathlib import Path
+from typing import Union
 
 import geojson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely
 from codetiming import Timer
 from geojson import Feature, FeatureCollection
 from numpy import ndarray
@@ -32,33 +41,286 @@ from shapely import wkb
 # Instantiate logger
 log = logging.getLogger("osm-rawdata")
 
+# The names of the bbox fields, older releases used minx instead of xmin
+BBOX_FIELDS = (("xmin", "ymin", "xmax", "ymax"), ("minx", "miny", "maxx", "maxy"))
+
+
+def datasetFiles(filespec: str) -> list:
+    """Find the parquet files in an Overture dataset.
+
+    Overture releases are hive partitioned directories of parquet
+    files, like theme=buildings/type=building/part-00000.parquet.
+
+    Args:
+        filespec (str): A parquet file, a dataset directory, or a glob
+
+    Returns:
+        (list): The parquet file of each fragment in the dataset
+    """
+    if Path(filespec).is_dir():
+        source = filespec
+    else:
+        source = sorted(glob.glob(filespec))
+        if len(source) == 0:
+            log.error(f"No parquet files match {filespec}!")
+            return list()
+    dataset = ds.dataset(source, format="parquet", partitioning="hive")
+
+    return sorted([fragment.path for fragment in dataset.get_fragments()])
+
 
 class Overture(object):
     def __init__(
         self,
         filespec: str = None,
+        aoi=None,
+        exclude: list = None,
     ):
         """A class for parsing Overture V2 files.
 
+        The file is opened lazily, only the metadata is read until
+        the data is iterated. When there's an AOI, only the row groups
+        whose bbox statistics overlap it are read, and only the rows
+        whose bbox overlaps it are kept.
+
         Args:
-            data (list): The list of features
+            filespec (str): The Overture parquet file
+            aoi (tuple, Geometry): The area of interest, a shapely geometry
+                or its (xmin, ymin, xmax, ymax) bounds
+            exclude (list): The datasets of the first source to skip,
+                like OpenStreetMap
         """
-        # pfile = pq.ParquetFile(filespec)
-        # self.data = pfile.read()
+        self.pfile = None
+        self._data = None
+        if aoi is not None and not isinstance(aoi, tuple):
+            aoi = tuple(aoi.bounds)
+        self.aoi = aoi
+        self.exclude = list(exclude or list())
         if filespec:
             try:
-                self.data = pd.read_parquet(filespec)
-                log.debug(f"Read {len(self.data)} entries from {filespec}")
-            except:
-                log.error(f"Couldn't read data from {filespec}!")
+                self.pfile = pq.ParquetFile(filespec)
+                log.debug(
+                    f"{filespec} has {self.pfile.metadata.num_rows} entries in "
+                    f"{self.pfile.num_row_groups} row groups"
+                )
+            except Exception as e:
+                log.error(f"Couldn't read data from {filespec}! {e}")
         self.filespec = filespec
 
+    @property
+    def data(self) -> pd.DataFrame:
+        """The whole file as a DataFrame, only read when first used."""
+        if self._data is None and self.filespec:
+            self._data = pd.read_parquet(self.filespec)
+            log.debug(f"Read {len(self._data)} entries from {self.filespec}")
+        return self._data
+
+    def iterBatches(
+        self,
+        groups: range = None,
+    ):
+        """Iterate through the row groups of the file as record batches.
+
+        Only one row group is in memory at a time.
+
+        Args:
+            groups (range): The row groups to read, default is all of them
+
+        Returns:
+            (generator): A RecordBatch for each row group
+        """
+        if self.pfile is None:
+            return
+        if groups is None:
+            groups = self.matchingGroups()
+        for group in groups:
+            yield self.readGroup(group)
+
+    @staticmethod
+    def _bboxFields(
+        names: list,
+    ) -> tuple:
+        """Get the names of the bbox fields the data uses.
+
+        Args:
+            names (list): The names of the fields in the bbox struct
+
+        Returns:
+            (tuple): The xmin, ymin, xmax, and ymax field names, or None
+        """
+        for fields in BBOX_FIELDS:
+            if all([name in names for name in fields]):
+                return fields
+
+        return None
+
+    def matchingGroups(self) -> list:
+        """Get the row groups that can have rows in the AOI.
+
+        The min and max statistics of the bbox columns are used, so the
+        data isn't read. Row groups without statistics are kept.
+
+        Returns:
+            (list): The index of each row group to read
+        """
+        if self.pfile is None:
+            return list()
+        total = self.pfile.num_row_groups
+        if self.aoi is None:
+            return list(range(0, total))
+
+        meta = self.pfile.metadata
+        columns = dict()
+        for index in range(0, meta.num_columns):
+            path = meta.schema.column(index).path
+            if path.startswith("bbox."):
+                columns[path[len("bbox.") :]] = index
+        fields = self._bboxFields(list(columns))
+        if fields is None:
+            return list(range(0, total))
+
+        xmin, ymin, xmax, ymax = self.aoi
+        groups = list()
+        for group in range(0, total):
+            row_group = meta.row_group(group)
+            stats = [row_group.column(columns[name]).statistics for name in fields]
+            if any([stat is None or not stat.has_min_max for stat in stats]):
+                groups.append(group)
+                continue
+            # A row group's features can't reach further than the largest
+            # xmax, or start further than the smallest xmin
+            if stats[2].max < xmin or stats[0].min > xmax:
+                continue
+            if stats[3].max < ymin or stats[1].min > ymax:
+                continue
+            groups.append(group)
+        log.debug(f"{len(groups)} of {total} row groups overlap the AOI")
+
+        return groups
+
+    def filter(
+        self,
+        data: pa.RecordBatch,
+    ) -> pa.RecordBatch:
+        """Remove the rows outside the AOI, or from an excluded dataset.
+
+        This uses Arrow compute, so the rows are never converted to python.
+
+        Args:
+            data (RecordBatch): The Overture data
+
+        Returns:
+            (RecordBatch): The rows to keep
+        """
+        mask = None
+        names = data.schema.names
+        if self.aoi is not None and "bbox" in names:
+            bbox = data.column("bbox")
+            fields = self._bboxFields([field.name for field in bbox.type])
+            if fields is not None:
+                xmin, ymin, xmax, ymax = [bbox.field(name) for name in fields]
+                inside = pc.and_(
+                    pc.and_(
+                        pc.greater_equal(xmax, self.aoi[0]),
+                        pc.less_equal(xmin, self.aoi[2]),
+                    ),
+                    pc.and_(
+                        pc.greater_equal(ymax, self.aoi[1]),
+                        pc.less_equal(ymin, self.aoi[3]),
+                    ),
+                )
+                mask = pc.fill_null(inside, True)
+        if len(self.exclude) > 0 and "sources" in names:
+            first = self._first(data.column("sources"))
+            if "dataset" in [field.name for field in first.type]:
+                excluded = pc.is_in(
+                    first.field("dataset"), value_set=pa.array(self.exclude)
+                )
+                keep = pc.invert(pc.fill_null(excluded, False))
+                mask = keep if mask is None else pc.and_(mask, keep)
+        if mask is None:
+            return data
+
+        return data.filter(mask)
+
+    def readGroup(
+        self,
+        group: int,
+    ) -> pa.RecordBatch:
+        """Read a single row group from the file, without the filtered rows.
+
+        Args:
+            group (int): The index of the row group
+
+        Returns:
+            (RecordBatch): The data in the row group
+        """
+        table = self.pfile.read_row_group(group).combine_chunks()
+        batches = table.to_batches()
+        if len(batches) == 0:
+            return pa.RecordBatch.from_pylist([], schema=table.schema)
+        return self.filter(batches[0])
+
+    def countRows(
+        self,
+        group: int,
+    ) -> int:
+        """Count the rows in a row group that aren't filtered out.
+
+        Only the columns used by the filter are read, so this is much
+        quicker than reading the row group.
+
+        Args:
+            group (int): The index of the row group
+
+        Returns:
+            (int): The number of rows readGroup() returns
+        """
+        columns = list()
+        if self.aoi is not None:
+            columns.append("bbox")
+        if len(self.exclude) > 0:
+            columns.append("sources")
+        columns = [name for name in columns if name in self.pfile.schema_arrow.names]
+        if len(columns) == 0:
+            return self.pfile.metadata.row_group(group).num_rows
+
+        table = self.pfile.read_row_group(group, columns=columns).combine_chunks()
+        batches = table.to_batches()
+        if len(batches) == 0:
+            return 0
+        return self.filter(batches[0]).num_rows
+
+    def checksum(
+        self,
+        group: int,
+    ) -> str:
+        """Get a checksum for a row group from the file metadata.
+
+        The data isn't read, the checksum uses the size and location of
+        each column chunk.
+
+        Args:
+            group (int): The index of the row group
+
+        Returns:
+            (str): The checksum of the row group
+        """
+        meta = self.pfile.metadata.row_group(group)
+        digest = hashlib.md5(f"{meta.num_rows}:{meta.total_byte_size}".encode())
+        for index in range(0, meta.num_columns):
+            chunk = meta.column(index)
+            digest.update(f"{chunk.file_offset}:{chunk.total_compressed_size}".encode())
+
+        return digest.hexdigest()
+
     def parse(
         self,
         data: Series,
     ):
         # log.debug(data)
         entry = dict()
+        geom = None
         # timer = Timer(text="importParquet() took {seconds:.0f}s")
         # timer.start()
         for key, value in data.to_dict().items():
@@ -123,6 +385,145 @@ class Overture(object):
         # timer.stop()
         return Feature(geometry=geom, properties=entry)
 
+    @staticmethod
+    def centres(data: pa.RecordBatch) -> tuple:
+        """Get the centre of each feature's bounding box.
+
+        The bbox column is used when it's in the data, with the field
+        names of the release, otherwise the geometries are decoded.
+
+        Args:
+            data (RecordBatch): The Overture data
+
+        Returns:
+            (tuple): Arrays of the longitudes and latitudes
+        """
+        fields = None
+        if "bbox" in data.schema.names:
+            bbox = data.column("bbox")
+            fields = Overture._bboxFields([field.name for field in bbox.type])
+        if fields is not None:
+            xmin, ymin, xmax, ymax = [
+                bbox.field(name).to_numpy(zero_copy_only=False) for name in fields
+            ]
+        else:
+            geoms = shapely.from_wkb(data.column("geometry").to_numpy(False))
+            xmin, ymin, xmax, ymax = shapely.bounds(geoms).T
+
+        return (xmin + xmax) / 2, (ymin + ymax) / 2
+
+    @staticmethod
+    def _first(data: pa.ListArray) -> pa.Array:
+        """Get the first element of each list.
+
+        Args:
+            data (ListArray): The lists
+
+        Returns:
+            (Array): The first elements, null for a null or empty list
+        """
+        lengths = pc.fill_null(pc.list_value_length(data), 0)
+        starts = pc.if_else(
+            pc.greater(lengths, 0),
+            data.offsets[:-1],
+            pa.scalar(None, data.offsets.type),
+        )
+        return data.values.take(starts)
+
+    def _flatten(
+        self,
+        data: Union[pa.RecordBatch, pa.Table],
+    ) -> list:
+        """Flatten the columns of a batch into OSM style tag columns.
+
+        This follows the same rules as parse(), the first entry of a list
+        is used, the fields of a struct in a list become tags, and only
+        the string and list fields of a nested struct are used.
+
+        Args:
+            data (RecordBatch, Table): The Overture data
+
+        Returns:
+            (list): Pairs of the tag name and the Array of values
+        """
+        columns = list()
+        for field in data.schema:
+            if field.name == "geometry" or field.name == "bbox":
+                continue
+            values = data.column(field.name)
+            if isinstance(values, pa.ChunkedArray):
+                values = pa.concat_arrays(values.chunks) if values.chunks else None
+            if values is None:
+                continue
+            if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+                first = self._first(values)
+                if pa.types.is_struct(first.type):
+                    for child, array in zip(first.type, first.flatten(), strict=True):
+                        if not pa.types.is_nested(child.type):
+                            columns.append((child.name, array))
+                elif not pa.types.is_nested(first.type):
+                    columns.append((field.name, first))
+            elif pa.types.is_struct(field.type):
+                for child, array in zip(field.type, values.flatten(), strict=True):
+                    if not pa.types.is_struct(child.type):
+                        continue
+                    for grandchild, nested in zip(
+                        child.type, array.flatten(), strict=True
+                    ):
+                        kind = grandchild.type
+                        if pa.types.is_list(kind) or pa.types.is_large_list(kind):
+                            first = self._first(nested)
+                            if not pa.types.is_struct(first.type):
+                                continue
+                            for leaf, leaves in zip(
+                                first.type, first.flatten(), strict=True
+                            ):
+                                if not pa.types.is_nested(leaf.type):
+                                    columns.append((leaf.name, leaves))
+                        elif pa.types.is_string(kind) or pa.types.is_large_string(kind):
+                            columns.append((grandchild.name, nested))
+
+        return columns
+
+    def parseBatch(
+        self,
+        data: Union[pa.RecordBatch, pa.Table],
+        table: bool = False,
+    ) -> Union[list, pa.Table]:
+        """Convert a batch of Overture data to OSM style tags.
+
+        This produces the same tags as parse(), but works on whole
+        columns at a time instead of each row.
+
+        Args:
+            data (RecordBatch, Table): The Overture data
+            table (bool): Whether to return an Arrow Table instead of dicts
+
+        Returns:
+            (list, Table): The tags for each row
+        """
+        columns = self._flatten(data)
+        if table:
+            # Later columns replace earlier ones with the same name
+            merged = dict()
+            for name, values in columns:
+                if name in merged:
+                    old = merged[name]
+                    if old.type != values.type:
+                        old = old.cast(pa.string())
+                        values = values.cast(pa.string())
+                    values = pc.coalesce(values, old)
+                merged[name] = values
+            return pa.Table.from_pydict(merged)
+
+        entries = [dict() for _ in range(0, data.num_rows)]
+        for name, values in columns:
+            for entry, value in zip(entries, values.to_pylist(), strict=True):
+                if value is not None:
+                    entry[name] = value
+
+        return entries
+
 
 def main():
     """This main function lets this class be run standalone by a bash script, primarily
@@ -154,18 +555,16 @@ def main():
         ch.setFormatter(formatter)
         log.addHandler(ch)
 
-    overture = Overture(args.infile)
+    overture = Overture(args.infile, exclude=["OpenStreetMap"])
 
     features = list()
     spin = PixelSpinner(f"Processing {args.infile}...")
     timer = Timer(text="Parsing Overture data file took {seconds:.0f}s")
     timer.start()
-    for index in overture.data.index:
-        spin.next()
-        feature = overture.data.loc[index]
-        entry = overture.parse(feature)
-        if entry["properties"]["dataset"] != "OpenStreetMap":
-            features.append(entry)
+    for batch in overture.iterBatches():
+        for _index, feature in batch.to_pandas().iterrows():
+            spin.next()
+            features.append(overture.parse(feature))
 
     if len(features) > 0:
         file = open(args.outfile, "w")
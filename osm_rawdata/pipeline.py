@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Humanitarian OpenStreetmap Team
+# 1100 13th Street NW Suite 800 Washington, D.C. 20005
+# <info@hotosm.org>
+
+"""A staged producer/consumer pipeline joined by bounded queues."""
+
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+from contextlib import ExitStack
+
+# Instantiate logger
+log = logging.getLogger("osm-rawdata")
+
+
+class Pipeline(object):
+    """Class to run items through stages of workers."""
+
+    def __init__(
+        self,
+        depth: int = 2,
+    ):
+        """Run items through stages of workers, joined by bounded queues.
+
+        The items are produced by the caller, and each stage passes what
+        its function returns on to the next stage. As the queues are
+        bounded, a slow stage makes the stages before it wait, so the
+        memory used doesn't depend on the size of the input.
+
+        Args:
+            depth (int): The number of items queued for each worker of a stage
+
+        Returns:
+            (Pipeline): An instance of this class
+        """
+        self.depth = depth
+        self.stages = list()
+        self.error = None
+        self.lock = threading.Lock()
+
+    def addStage(
+        self,
+        function,
+        workers: int = 1,
+        processes: bool = False,
+        args: list = None,
+        name: str = None,
+    ):
+        """Add a stage to the end of the pipeline.
+
+        The function is called with each item, followed by the arguments
+        for the worker. If it returns None nothing is passed on.
+
+        Args:
+            function (callable): The function to run on each item
+            workers (int): The number of workers for this stage
+            processes (bool): Whether to run the function in worker processes,
+                the function, items, and results must then be picklable
+            args (list): The extra arguments for each worker, for example
+                a database connection
+            name (str): The name of the stage in the statistics
+
+        Returns:
+            (Pipeline): This pipeline, so stages can be chained
+        """
+        workers = max(workers, 1)
+        if args is not None and len(args) < workers:
+            raise ValueError(f"Only {len(args)} arguments for {workers} workers")
+        self.stages.append(
+            {
+                "name": name or getattr(function, "__name__", "stage"),
+                "function": function,
+                "workers": workers,
+                "processes": processes,
+                "args": args,
+            }
+        )
+
+        return self
+
+    def _fail(
+        self,
+        error: Exception,
+    ):
+        """Record the first error, which stops the reader and the workers.
+
+        Args:
+            error (Exception): The error
+        """
+        with self.lock:
+            if self.error is None:
+                self.error = error
+
+    def _worker(
+        self,
+        index: int,
+        stage: int,
+        queues: list,
+        executor: concurrent.futures.Executor = None,
+    ):
+        """Thread to run the function of a stage on each item in its queue.
+
+        Args:
+            index (int): The worker number in the stage
+            stage (int): The stage number
+            queues (list): The queue for each stage, and the results
+            executor (Executor): The worker processes, if the stage uses them
+        """
+        config = self.stages[stage]
+        function = config["function"]
+        args = config["args"][index] if config["args"] else tuple()
+        inbox = queues[stage]
+        outbox = queues[stage + 1]
+        while (item := inbox.get()) is not None:
+            # Keep draining the queue after an error so nothing upstream blocks
+            if self.error is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                if executor is not None:
+                    result = executor.submit(function, item, *args).result()
+                else:
+                    result = function(item, *args)
+            except Exception as e:
+                log.error(f"{config['name']} failed: {e}")
+                self._fail(e)
+                continue
+            done = time.perf_counter()
+            if result is not None:
+                outbox.put(result)
+            with self.lock:
+                config["items"] += 1
+                config["busy"] += done - start
+                config["blocked"] += time.perf_counter() - done
+
+        # The last worker to finish tells the next stage there's no more
+        with self.lock:
+            config["running"] -= 1
+            last = config["running"] == 0
+        if last and stage + 1 < len(self.stages):
+            for _ in range(0, self.stages[stage + 1]["workers"]):
+                outbox.put(None)
+
+    def run(
+        self,
+        items,
+    ) -> list:
+        """Run the items through the pipeline.
+
+        Args:
+            items (iterable): The items for the first stage, usually a generator
+
+        Returns:
+            (list): What the last stage returned for each item
+        """
+        self.error = None
+        for stage in self.stages:
+            stage.update(
+                {"items": 0, "busy": 0.0, "blocked": 0.0, "running": stage["workers"]}
+            )
+        queues = [
+            queue.Queue(maxsize=self.depth * stage["workers"]) for stage in self.stages
+        ]
+        # The results are only as many as the items that made it through
+        queues.append(queue.SimpleQueue())
+        total = sum([stage["workers"] for stage in self.stages])
+        blocked = 0.0
+        with ExitStack() as stack:
+            executors = list()
+            for stage in self.stages:
+                executor = None
+                if stage["processes"]:
+                    executor = stack.enter_context(
+                        concurrent.futures.ProcessPoolExecutor(
+                            max_workers=stage["workers"]
+                        )
+                    )
+                executors.append(executor)
+            # The threads are joined before the worker processes shut down
+            threads = stack.enter_context(
+                concurrent.futures.ThreadPoolExecutor(max_workers=total)
+            )
+            futures = list()
+            for stage, config in enumerate(self.stages):
+                for index in range(0, config["workers"]):
+                    futures.append(
+                        threads.submit(
+                            self._worker, index, stage, queues, executors[stage]
+                        )
+                    )
+            try:
+                for item in items:
+                    if self.error is not None:
+                        break
+                    start = time.perf_counter()
+                    queues[0].put(item)
+                    blocked += time.perf_counter() - start
+            except Exception as e:
+                log.error(f"Couldn't read the input: {e}")
+                self._fail(e)
+            for _ in range(0, self.stages[0]["workers"]):
+                queues[0].put(None)
+            for future in futures:
+                future.result()
+
+        log.debug(f"read: {blocked:.1f}s blocked")
+        for stage in self.stages:
+            log.debug(
+                f"{stage['name']}: {stage['items']} items with "
+                f"{stage['workers']} workers, {stage['busy']:.1f}s busy, "
+                f"{stage['blocked']:.1f}s blocked"
+            )
+        if self.error is not None:
+            raise self.error
+
+        results = list()
+        while not queues[-1].empty():
+            results.append(queues[-1].get())
+
+        return results
@@ -43,6 +43,7 @@ from shapely.ops import unary_union
 # Find the other files for this project
 import osm_rawdata as rw
 from osm_rawdata.config import QueryConfig
+from osm_rawdata.grid import gridCovering
 
 rootdir = rw.__path__[0]
 
@@ -122,6 +123,66 @@ def uriParser(source):
     }
 
 
+def parseRefs(refs) -> list:
+    """Get the node IDs of a way as a list of integers.
+
+    The refs column is a bigint[], which psycopg2 already returns as a
+    list, but databases imported before it was could have it as text.
+
+    Args:
+        refs (list, str): The refs column
+
+    Returns:
+        (list): The node IDs
+    """
+    if refs is None:
+        return list()
+    if isinstance(refs, str):
+        refs = refs.strip("{}")
+        if len(refs) == 0:
+            return list()
+        refs = refs.split(",")
+
+    return [int(ref) for ref in refs]
+
+
+def deltaEncode(refs: list) -> list:
+    """Delta encode the node IDs of a way.
+
+    Nodes added together have close IDs, so the differences between
+    them are much smaller numbers than the IDs, which makes the refs
+    of a large extract a lot smaller once serialized.
+
+    Args:
+        refs (list): The node IDs
+
+    Returns:
+        (list): The first ID, followed by the difference from the one before
+    """
+    # With no refs the list of previous ones still has the 0
+    previous = [0] + refs[:-1]
+
+    return [ref - last for last, ref in zip(previous, refs, strict=False)]
+
+
+def deltaDecode(deltas: list) -> list:
+    """Decode the node IDs of a way from deltaEncode().
+
+    Args:
+        deltas (list): The first ID, followed by the difference from the one before
+
+    Returns:
+        (list): The node IDs
+    """
+    refs = list()
+    ref = 0
+    for delta in deltas:
+        ref += delta
+        refs.append(ref)
+
+    return refs
+
+
 class DatabaseAccess(object):
     def __init__(
         self,
@@ -134,6 +195,7 @@ class DatabaseAccess(object):
         """
         self.dbshell = None
         self.dbcursor = None
+        self.grids = dict()
         self.uri = uriParser(dburi)
         if self.uri["dbname"] == "underpass":
             # Use a persistant connect, better for multiple requests
@@ -321,10 +383,11 @@ class DatabaseAccess(object):
         query = ""
         for table in config.config["tables"]:
             select = "SELECT "
-            if allgeom:
+            if allgeom or table == "nodes":
                 select += "ST_AsText(geom) AS geometry"
             else:
-                select += "ST_AsText(ST_Centroid(geom)) AS geometry"
+                # The centroid is generated by postgres when the row is written
+                select += "ST_AsText(centroid) AS geometry"
             select += ", osm_id, version, "
             for entry in config.config["select"][table]:
                 for k1, v1 in entry.items():
@@ -439,11 +502,46 @@ class DatabaseAccess(object):
             log.error(f"Couldn't execute query! {sql}")
             return list()
 
+    def gridFilter(
+        self,
+        table: str,
+        boundary: Polygon,
+    ) -> str:
+        """Get the SQL to only query the grid cells a boundary covers.
+
+        When the table is partitioned on the grid cell, this lets the
+        planner skip the partitions outside the boundary.
+
+        Args:
+            table (str): The table to query
+            boundary (Polygon): The boundary polygon
+
+        Returns:
+            (str): The SQL to add to the WHERE clause, empty if the table has no grid
+        """
+        if table not in self.grids:
+            sql = (
+                "SELECT count(*) FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = %s"
+                " AND column_name = 'grid'"
+            )
+            self.dbcursor.execute(sql, (table,))
+            self.grids[table] = self.dbcursor.fetchone()[0] > 0
+        if not self.grids[table]:
+            return ""
+
+        # Features are in the cell of the centre of their bounding box, which
+        # is inside the boundary when the boundary contains the feature
+        cells = ", ".join([str(cell) for cell in gridCovering(*boundary.bounds)])
+
+        return f" AND (grid IN ({cells}) OR grid IS NULL)"
+
     def queryLocal(
         self,
         query: str,
         allgeom: bool = True,
         boundary: Polygon = None,
+        compact: bool = False,
     ):
         """This query a local postgres database.
 
@@ -451,6 +549,7 @@ class DatabaseAccess(object):
             query (str): The SQL query to execute
             allgeom (bool): Whether to return centroids or all the full geometry
             boundary (Polygon): The boundary polygon
+            compact (bool): Whether to delta encode the refs of the ways
 
         Returns:
                 query (FeatureCollection): the results of the query
@@ -458,13 +557,30 @@ class DatabaseAccess(object):
         features = list()
         # if no boundary, it's already been setup
         if boundary:
-            sql = f"DROP VIEW IF EXISTS ways_view;CREATE VIEW ways_view AS SELECT * FROM ways_poly WHERE ST_CONTAINS(ST_GeomFromEWKT('SRID=4326;{boundary.wkt}'), geom)"
+            within = f"ST_CONTAINS(ST_GeomFromEWKT('SRID=4326;{boundary.wkt}'), geom)"
+            sql = (
+                "DROP VIEW IF EXISTS ways_view;"
+                f"CREATE VIEW ways_view AS SELECT * FROM ways_poly WHERE {within}"
+                f"{self.gridFilter('ways_poly', boundary)}"
+            )
             self.dbcursor.execute(sql)
-            sql = f"DROP VIEW IF EXISTS nodes_view;CREATE VIEW nodes_view AS SELECT * FROM nodes WHERE ST_CONTAINS(ST_GeomFromEWKT('SRID=4326;{boundary.wkt}'), geom)"
+            sql = (
+                "DROP VIEW IF EXISTS nodes_view;"
+                f"CREATE VIEW nodes_view AS SELECT * FROM nodes WHERE {within}"
+                f"{self.gridFilter('nodes', boundary)}"
+            )
             self.dbcursor.execute(sql)
-            sql = f"DROP VIEW IF EXISTS lines_view;CREATE VIEW lines_view AS SELECT * FROM ways_line WHERE ST_CONTAINS(ST_GeomFromEWKT('SRID=4326;{boundary.wkt}'), geom)"
+            sql = (
+                "DROP VIEW IF EXISTS lines_view;"
+                f"CREATE VIEW lines_view AS SELECT * FROM ways_line WHERE {within}"
+                f"{self.gridFilter('ways_line', boundary)}"
+            )
             self.dbcursor.execute(sql)
-            sql = f"DROP VIEW IF EXISTS relations_view;CREATE TEMP VIEW relations_view AS SELECT * FROM nodes WHERE ST_CONTAINS(ST_GeomFromEWKT('SRID=4326;{boundary.wkt}'), geom)"
+            sql = (
+                "DROP VIEW IF EXISTS relations_view;"
+                f"CREATE TEMP VIEW relations_view AS SELECT * FROM nodes WHERE {within}"
+                f"{self.gridFilter('nodes', boundary)}"
+            )
             self.dbcursor.execute(sql)
 
             if query.find(" ways_poly ") > 0:
@@ -501,8 +617,8 @@ class DatabaseAccess(object):
             # tags["id"] = item[1]
             tags["version"] = item[2]
             if query.find(" refs ") > 0:
-                tags["refs"] = str(item[len(item) - 1])
-                # breakpoint()
+                refs = parseRefs(item[len(item) - 1])
+                tags["refs"] = deltaEncode(refs) if compact else refs
             i = 3
             # Figure out the tags from the SELECT part of the query
             keys = query.replace(",", "").replace("tags->>", "").replace("'", "")
@@ -732,6 +848,7 @@ class PostgresClient(DatabaseAccess):
         customsql: str = None,
         allgeom: bool = True,
         extra_params: dict = {},
+        compact: bool = False,
     ):
         """This class generates executes the query using a local postgres
         database, or a remote one that uses the Underpass schema.
@@ -740,6 +857,8 @@ class PostgresClient(DatabaseAccess):
             boundary (FeatureCollection, Feature, dict, str): The boundary polygon.
             customsql (str): Don't create the SQL, use the one supplied.
             allgeom (bool): Whether to return centroids or all the full geometry.
+            extra_params (dict): Extra parameters for a remote query.
+            compact (bool): Whether to delta encode the refs of the ways.
 
         Returns:
                 query (FeatureCollection): the json
@@ -782,7 +901,7 @@ class PostgresClient(DatabaseAccess):
             alldata = list()
             for query in sql:
                 # print(query)
-                result = self.queryLocal(query, allgeom, aoi_shape)
+                result = self.queryLocal(query, allgeom, aoi_shape, compact)
                 if len(result) > 0:
                     alldata += result["features"]
             collection = FeatureCollection(alldata)
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This file is part of osm_rawdata.
+#
+#     This is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Underpass is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with osm_rawdata.  If not, see <https:#www.gnu.org/licenses/>.
+#
+"""Compare the buffers an AOI extract touches in a sorted and unsorted load.
+
+Import the same file twice, once with sort=True, then run:
+
+    python tests/bench_locality.py -u localhost/unsorted -s localhost/sorted
+
+The fewer pages an extract has to touch, the better the locality.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+import geojson
+from shapely.geometry import shape
+
+# Find the other files for this project
+import osm_rawdata as rw
+from osm_rawdata.postgres import DatabaseAccess
+
+rootdir = rw.__path__[0]
+if os.path.basename(rootdir) == "osm_rawdata":
+    rootdir = "./tests/"
+
+log = logging.getLogger("osm-rawdata")
+
+
+def bufferUsage(
+    db: DatabaseAccess,
+    table: str,
+    boundary: str,
+) -> dict:
+    """Run an AOI extract and get the buffers it used.
+
+    Args:
+        db (DatabaseAccess): The database to query
+        table (str): The table to query
+        boundary (str): The WKT of the AOI
+
+    Returns:
+        (dict): The number of rows, and the shared buffers hit and read
+    """
+    sql = (
+        f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT tags, geom FROM {table}"
+        f" WHERE ST_Intersects(geom, ST_GeomFromText('{boundary}', 4326))"
+    )
+    result = db.execute(sql)
+    plan = result[0][0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]["Plan"]
+
+    return {
+        "rows": plan["Actual Rows"],
+        "hit": plan["Shared Hit Blocks"],
+        "read": plan["Shared Read Blocks"],
+    }
+
+
+def main():
+    """Compare the buffer usage of AOI extracts in two databases."""
+    parser = argparse.ArgumentParser(
+        prog="bench_locality",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Compare AOI extract buffer usage for sorted and unsorted loads",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="verbose output")
+    parser.add_argument("-u", "--unsorted", required=True, help="Unsorted database URI")
+    parser.add_argument("-s", "--sorted", required=True, help="Sorted database URI")
+    parser.add_argument(
+        "-b",
+        "--boundary",
+        nargs="+",
+        default=[f"{rootdir}/AOI_small.geojson", f"{rootdir}/AOI.geojson"],
+        help="The AOIs to extract",
+    )
+    parser.add_argument("-t", "--table", default="ways_poly", help="The table")
+    args = parser.parse_args()
+
+    # if verbose, dump to the terminal.
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+        ch = logging.StreamHandler(sys.stdout)
+        ch.setLevel(logging.DEBUG)
+        log.addHandler(ch)
+
+    databases = {
+        "unsorted": DatabaseAccess(args.unsorted),
+        "sorted": DatabaseAccess(args.sorted),
+    }
+    for filespec in args.boundary:
+        with open(filespec, "r") as infile:
+            aoi = geojson.load(infile)
+        if aoi["type"] == "FeatureCollection":
+            aoi = aoi["features"][0]
+        if aoi["type"] == "Feature":
+            aoi = aoi["geometry"]
+        boundary = shape(aoi).wkt
+        for name, db in databases.items():
+            usage = bufferUsage(db, args.table, boundary)
+            pages = usage["hit"] + usage["read"]
+            print(
+                f"{os.path.basename(filespec)} {name}: {usage['rows']} rows, "
+                f"{usage['hit']} hit, {usage['read']} read, {pages} pages"
+            )
+
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone."""
+    main()
@@ -22,6 +22,7 @@ import sys
 
 import psycopg2
 import pytest
+from sqlalchemy import create_engine
 
 logging.basicConfig(
     level="DEBUG",
@@ -40,3 +41,9 @@ log = logging.getLogger(__name__)
 def db():
     """Existing psycopg2 connection."""
     return psycopg2.connect("postgresql://fmtm:testpass@db:5432/underpass")
+
+
+@pytest.fixture(scope="session")
+def engine():
+    """SQLAlchemy engine for the same database."""
+    return create_engine("postgresql://fmtm:testpass@db:5432/underpass")
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This file is part of osm_rawdata.
+#
+#     This is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Underpass is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with osm_rawdata.  If not, see <https:#www.gnu.org/licenses/>.
+#
+"""Tests for generating a filtered flex style."""
+
+import os
+
+import osm_rawdata as rw
+from osm_rawdata.config import QueryConfig
+from osm_rawdata.flexstyle import FlexStyle, luaString
+
+rootdir = rw.__path__[0]
+if os.path.basename(rootdir) == "osm_rawdata":
+    rootdir = "./tests/"
+
+
+def test_filters():
+    """Test the where and keep entries become the filters."""
+    style = FlexStyle([f"{rootdir}/buildings.yaml"])
+    assert style.filters["ways_line"] == []
+    nodes = style.filters["nodes"]
+    assert len(nodes) == 1
+    assert nodes[0]["any"] == [("building", ["yes"]), ("amenity", [])]
+    assert nodes[0]["all"] == [
+        ("building:material", ["wood"]),
+        ("roof:material", ["metal"]),
+    ]
+    assert "building" in nodes[0]["keep"]
+    assert "roof:shape" in nodes[0]["keep"]
+    assert "version" not in nodes[0]["keep"]
+    assert style.filters["relations"] == style.filters["ways_poly"]
+
+
+def test_generate():
+    """Test the generated style wraps raw.lua."""
+    config = QueryConfig()
+    config.parseJson(f"{rootdir}/levels.json")
+    style = FlexStyle([config, f"{rootdir}/buildings.yaml"])
+    lua = style.generate()
+    assert "osm2pgsql.define_table" in lua
+    assert "local filters = {" in lua
+    assert "function osm2pgsql.process_way(object)" in lua
+    assert luaString("roof:shape") in lua
+    assert luaString("it's") == "'it\\'s'"
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This file is part of osm_rawdata.
+#
+#     This is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Underpass is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with osm_rawdata.  If not, see <https:#www.gnu.org/licenses/>.
+#
+"""Tests for the grid the tables are partitioned on."""
+
+from osm_rawdata.grid import GRID_COLUMNS, gridCell, gridCovering, gridSql
+
+
+def test_cell():
+    """Features are in the cell of their bounding box centre."""
+    assert gridCell(-180, -90) == 0
+    assert gridCell(85.3, 27.7) == 422
+    # The edges of the world are in the last cells
+    assert gridCell(180, 90) == GRID_COLUMNS * 18 - 1
+
+
+def test_covering():
+    """The cells covering a boundary include all the cells it touches."""
+    assert gridCovering(85.2, 27.6, 85.4, 27.8) == [422]
+    assert gridCovering(79, 25, 92, 31) == [421, 422, 423, 457, 458, 459]
+
+
+def test_sql():
+    """The SQL uses the same grid as the python."""
+    sql = gridSql("geom")
+    assert "ST_XMin(geom)" in sql
+    assert f"* {GRID_COLUMNS} +" in sql
+
+
+if __name__ == "__main__":
+    """This is just a hook so this file can be run standalone during development."""
+    test_cell()
+    test_covering()
+    test_sql()
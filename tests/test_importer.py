@@ -0,0 +1,381 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This file is part of osm_rawdata.
+#
+#     This is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Underpass is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with osm_rawdata.  If not, see <https:#www.gnu.org/licenses/>.
+#
+"""Tests for the data importer helpers."""
+
+import json
+import os
+import struct
+from datetime import datetime
+
+import pyarrow as pa
+from sqlalchemy import text
+
+import osm_rawdata as rw
+from osm_rawdata.bulkload import (
+    BulkLoader,
+    contentHash,
+    createPartitions,
+    encodeRows,
+    encodeValue,
+    forgetPartitions,
+    hilbertKeys,
+    partitioned,
+    partitions,
+    toEwkb,
+    wkbType,
+)
+from osm_rawdata.importer import (
+    convertGeoJson,
+    convertParquet,
+    estimateError,
+    indexMethod,
+    osm2pgsqlProfile,
+    parseOsm2pgsql,
+    readChanges,
+    readGeoJson,
+    readLines,
+    readState,
+    splitLines,
+    tagPredicate,
+    tagPredicates,
+)
+
+rootdir = rw.__path__[0]
+if os.path.basename(rootdir) == "osm_rawdata":
+    rootdir = "./tests/"
+
+
+def test_encode_value():
+    """Test values are encoded in the postgres binary COPY format."""
+    assert encodeValue("bigint", None) == struct.pack(">i", -1)
+    assert encodeValue("bigint", -1) == struct.pack(">iq", 8, -1)
+    jsonb = encodeValue("jsonb", {"building": "yes"})
+    assert jsonb == struct.pack(">i", 20) + b'\x01{"building": "yes"}'
+    geom = encodeValue("geometry", b"\x01\x01\x00\x00\x20")
+    assert geom[:4] == struct.pack(">i", 5)
+
+
+def test_read_geojson(tmp_path):
+    """Test GeoJson and GeoJsonSeq files are read in fixed size batches."""
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(index), 0.0]},
+            "properties": {"index": index},
+        }
+        for index in range(0, 5)
+    ]
+    collection = tmp_path / "features.geojson"
+    collection.write_text(
+        json.dumps({"type": "FeatureCollection", "features": features})
+    )
+    sequence = tmp_path / "features.geojsonl"
+    sequence.write_text("\n".join([json.dumps(feature) for feature in features]))
+
+    for infile in (collection, sequence):
+        batches = list(readGeoJson(str(infile), 2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert batches[2][0]["properties"]["index"] == 4
+
+
+def test_split_lines(tmp_path):
+    """Test a GeoJsonSeq file is split into byte ranges of whole lines."""
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(index), 0.0]},
+            "properties": {"name": "x" * index},
+        }
+        for index in range(0, 20)
+    ]
+    sequence = tmp_path / "features.geojsonl"
+    sequence.write_text("\n".join([json.dumps(feature) for feature in features]))
+
+    for parts in (1, 3, 100):
+        ranges = splitLines(str(sequence), parts)
+        assert len(ranges) <= parts
+        assert ranges[0][0] == 0
+        assert ranges[-1][1] == sequence.stat().st_size
+        names = list()
+        for start, end in ranges:
+            for _first, _last, batch in readLines(str(sequence), start, end, 3):
+                assert len(batch) <= 3
+                names.extend([feature["properties"]["name"] for feature in batch])
+        assert names == [feature["properties"]["name"] for feature in features]
+
+
+def test_merge_columns():
+    """Test merging adds a source ID and a hash of the content."""
+    point = b"\x01" + struct.pack("<Idd", 1, 85.3, 27.7)
+    assert contentHash(point, {"a": 1, "b": 2}) == contentHash(point, {"b": 2, "a": 1})
+    assert contentHash(point, {"a": 1}) != contentHash(point, {"a": 2})
+
+    features = [
+        {
+            "type": "Feature",
+            "id": "way/1",
+            "geometry": {"type": "Point", "coordinates": [85.3, 27.7]},
+            "properties": {},
+        },
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [85.3, 27.7]},
+            "properties": {"osm_id": 2},
+        },
+    ]
+    batch = convertGeoJson((None, features), merge=True)
+    columns, data, count = batch["tables"]["nodes"]
+    assert columns == ["geom", "tags", "grid", "source_id", "hash"]
+    assert count == 2
+    assert b"way/1" in data
+
+    batch = convertGeoJson((None, features))
+    assert batch["tables"]["nodes"][0] == ["geom", "tags", "grid"]
+
+
+def test_empty_geometry():
+    """Test a feature without a bbox centre goes in the default partition."""
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": []},
+            "properties": {},
+        },
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [85.3, 27.7]},
+            "properties": {},
+        },
+    ]
+    batch = convertGeoJson((None, features))
+    assert batch["cells"] == {"nodes": [422], "ways_line": [], "ways_poly": []}
+    columns, data, count = batch["tables"]["ways_poly"]
+    assert count == 1
+    assert encodeValue("int", None) in data
+
+
+def test_forget_partitions():
+    """Test the partitions are checked again after the table layout changes."""
+    partitioned["nodes"] = True
+    partitions.add(("nodes", 422))
+    # The partitions already created don't need the database
+    createPartitions(None, "nodes", [422])
+    forgetPartitions()
+    assert len(partitioned) == 0
+    assert len(partitions) == 0
+
+
+def test_allocated_ids():
+    """Test features get negative IDs from the allocated ranges."""
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [85.3, 27.7]},
+            "properties": {},
+        }
+        for index in range(0, 3)
+    ]
+    batch = convertGeoJson((None, features, [range(10, 12), range(20, 21)]))
+    columns, data, count = batch["tables"]["nodes"]
+    assert columns == ["geom", "tags", "grid", "osm_id"]
+    for osm_id in (-10, -11, -20):
+        assert encodeValue("bigint", osm_id) in data
+
+
+def test_exclude_datasets():
+    """Test the Overture datasets that are skipped can be chosen."""
+    point = b"\x01" + struct.pack("<Idd", 1, 85.3, 27.7)
+    datasets = ["OpenStreetMap", "Microsoft ML Buildings", "Esri"]
+    source = pa.struct([("dataset", pa.string())])
+    data = pa.RecordBatch.from_arrays(
+        [
+            pa.array(["a", "b", "c"]),
+            pa.array([point] * 3, type=pa.binary()),
+            pa.array([[{"dataset": name}] for name in datasets], type=pa.list_(source)),
+        ],
+        names=["id", "geometry", "sources"],
+    )
+
+    def rows(**options):
+        batch = convertParquet((None, data), **options)
+        return batch["tables"]["nodes"][2]
+
+    # Only the dataset that isn't in SKIPPED_DATASETS is kept by default
+    assert rows() == 1
+    assert rows(exclude=["OpenStreetMap"]) == 2
+    assert rows(exclude=()) == 3
+
+
+def test_ewkb():
+    """Test an SRID is added to a WKB without decoding the geometry."""
+    point = b"\x01" + struct.pack("<Idd", 1, 85.3, 27.7)
+    ewkb = toEwkb(point, 4326)
+    assert ewkb == b"\x01" + struct.pack("<IIdd", 0x20000001, 4326, 85.3, 27.7)
+    assert toEwkb(ewkb, 4326) == ewkb
+    assert wkbType(point) == "Point"
+    assert wkbType(ewkb) == "Point"
+    assert wkbType(b"\x00" + struct.pack(">I", 6)) == "MultiPolygon"
+
+
+def test_hilbert_keys():
+    """Test the Hilbert curve visits the quadrants in order."""
+    x = [-90.0, -90.0, 90.0, 90.0]
+    y = [-45.0, 45.0, 45.0, -45.0]
+    assert list(hilbertKeys(x, y, 1)) == [0, 1, 2, 3]
+    # Nearby points are closer on the curve than distant ones
+    keys = hilbertKeys([85.30, 85.31, -70.0], [27.70, 27.71, -30.0])
+    assert abs(keys[0] - keys[1]) < abs(keys[0] - keys[2])
+
+
+def test_osm2pgsql_profile(tmp_path):
+    """Test the osm2pgsql settings scale with the input size."""
+    small = tmp_path / "small.osm.pbf"
+    small.write_bytes(b"\0" * 1024 * 1024)
+    profile = osm2pgsqlProfile(str(small), memory=16 * 1024, processes=4)
+    assert not profile["slim"]
+    assert profile["flat_nodes"] is None
+    assert profile["processes"] == 4
+
+    # A sparse file is enough for the size check
+    large = tmp_path / "planet.osm.pbf"
+    with open(large, "wb") as file:
+        file.truncate(70 * 1024 * 1024 * 1024)
+    profile = osm2pgsqlProfile(str(large), memory=64 * 1024, drop=True)
+    assert profile["slim"]
+    assert profile["drop"]
+    assert profile["flat_nodes"].endswith("planet.osm.nodes")
+    assert profile["cache"] == 0
+
+
+def test_parse_osm2pgsql():
+    """Test the stage timings are parsed from the osm2pgsql output."""
+    lines = [
+        "2024-01-15 10:00:00  osm2pgsql version 1.9.2",
+        "2024-01-15 10:02:03  Reading input files done in 123s (2m 3s).",
+        "2024-01-15 10:02:03    Processed 1000 nodes in 100s (1m 40s) - 10/s",
+        "2024-01-15 10:02:03  Node stats: total(1000), max(12345) in 100s",
+        "2024-01-15 10:02:03  Way stats: total(200), max(678) in 20s",
+        "2024-01-15 10:02:10  All postprocessing on table 'nodes' done in 7s.",
+        "2024-01-15 10:02:10  osm2pgsql took 130s (2m 10s) overall.",
+    ]
+    result = parseOsm2pgsql(lines)
+    assert result["total"] == 130
+    assert result["stages"]["Reading input files"] == 123
+    assert result["stages"]["All postprocessing on table 'nodes'"] == 7
+    assert result["objects"]["node"] == {"total": 1000, "max": 12345, "seconds": 100}
+    assert result["objects"]["way"]["total"] == 200
+
+
+def test_read_changes(tmp_path):
+    """Test change files are found in a replication directory."""
+    for sequence in ("000/123/456", "000/123/457", "000/124/000"):
+        path = tmp_path / f"{sequence}.osc.gz"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    state = tmp_path / "000/123/457.state.txt"
+    state.write_text(
+        "#Sat Jan 13 21:22:03 UTC 2024\nsequenceNumber=123457\n"
+        "timestamp=2024-01-13T21\\:21\\:55Z\n"
+    )
+
+    changes = sorted(readChanges(str(tmp_path)))
+    assert [sequence for sequence, path in changes] == [123456, 123457, 124000]
+    assert readState(changes[0][1]) == {}
+    assert readState(changes[1][1]) == {
+        "sequence": 123457,
+        "timestamp": datetime(2024, 1, 13, 21, 21, 55),
+    }
+
+
+def test_tag_predicates():
+    """Test the tag filters of the query configs become SQL like createSQL()."""
+    predicates = tagPredicates([f"{rootdir}/buildings.yaml"])
+    assert predicates["ways_line"] == []
+    assert ("building", ["yes"]) in predicates["nodes"]
+    assert ("amenity", []) in predicates["nodes"]
+    assert tagPredicate("building", ["yes"]) == "tags->>'building' = 'yes'"
+    assert tagPredicate("amenity", []) == "tags->>'amenity' IS NOT NULL"
+    assert tagPredicate("shop", ["bakery", "Joe's"]) == (
+        "tags->>'shop' IN ('bakery', 'Joe''s')"
+    )
+
+
+def test_estimate_error():
+    """Test the estimate error is the same whether too high or too low."""
+    assert estimateError(100, 100) == 1
+    assert estimateError(10, 1000) == 100
+    assert estimateError(1000, 10) == 100
+    assert estimateError(0.5, 0) == 1
+
+
+def test_index_method():
+    """Test indexes are compared on the method and columns only."""
+    indexdef = (
+        "CREATE INDEX nodes_geom_idx ON public.nodes"
+        " USING gist (geom) WITH (fillfactor='100')"
+    )
+    assert indexMethod(indexdef) == "gist (geom)"
+    indexdef = (
+        "CREATE INDEX ways_poly_tags_idx ON ONLY public.ways_poly USING gin (tags)"
+    )
+    assert indexMethod(indexdef) == "gin (tags)"
+
+
+def test_duplicates():
+    """Test the SQL that skips polygons duplicating OSM buildings."""
+    loader = BulkLoader(None, dedup=True, iou=0.6)
+    sql = loader._duplicates("ways_poly")
+    assert sql.startswith("WHERE NOT EXISTS (SELECT 1 FROM ways_poly AS osm ")
+    assert "osm.osm_id > 0 AND osm.tags ? 'building'" in sql
+    assert "osm.geom && batch.geom" in sql
+    overlap = "ST_Area(ST_Intersection(osm.geom, batch.geom))"
+    assert (
+        f"{overlap} >= 0.6 * (ST_Area(osm.geom) + ST_Area(batch.geom) - {overlap})"
+        in sql
+    )
+    assert loader._duplicates("nodes") == ""
+    assert BulkLoader(None)._duplicates("ways_poly") == ""
+
+
+def test_batch_table():
+    """Test batches with different columns use different temporary tables."""
+    loader = BulkLoader(None, merge=True)
+    name = loader._batchTable("nodes", ["geom", "tags", "source_id", "hash"])
+    assert name.startswith("batch_nodes_")
+    assert name == loader._batchTable("nodes", ["geom", "tags", "source_id", "hash"])
+    assert name != loader._batchTable("nodes", ["geom", "tags", "grid", "source_id"])
+
+
+def test_copy_committed(engine):
+    """Test rows written by COPY alone are committed."""
+    with engine.connect() as db:
+        db.execute(text("DROP TABLE IF EXISTS bulkload_test"))
+        db.execute(text("CREATE TABLE bulkload_test (osm_id bigint, tags jsonb)"))
+        db.commit()
+        # Nothing has started a transaction on the connection before the COPY
+        loader = BulkLoader(db)
+        columns, data = encodeRows([{"osm_id": -1, "tags": {"building": "yes"}}])
+        loader.copyData("bulkload_test", columns, data, 1)
+        assert loader.flush() == 1
+        with engine.connect() as other:
+            sql = text("SELECT count(*) FROM bulkload_test")
+            assert other.execute(sql).scalar() == 1
+        db.execute(text("DROP TABLE bulkload_test"))
+        db.commit()
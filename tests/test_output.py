@@ -79,8 +79,22 @@ def test_json():
     assert item == new["filters"]["tags"]["point"]["join_or"]["amenity"]
 
 
+def test_centroid():
+    """Test the ways are queried with their stored centroid."""
+    db = DatabaseAccess("underpass")
+    qc = QueryConfig()
+    qc.parseYaml(f"{rootdir}/buildings.yaml")
+    sql = db.createSQL(qc, False)
+    # Nodes are already points, the ways use the stored centroid
+    assert sql[0].startswith("SELECT ST_AsText(geom) AS geometry, osm_id")
+    assert sql[1].startswith("SELECT ST_AsText(centroid) AS geometry, osm_id")
+    assert "ST_Centroid" not in sql[1]
+
+
 if __name__ == "__main__":
     print("--- test_yaml() ---")
     test_yaml()
     print("--- test_json() ---")
     test_json()
+    print("--- test_centroid() ---")
+    test_centroid()
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This file is part of osm_rawdata.
+#
+#     This is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Underpass is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with osm_rawdata.  If not, see <https:#www.gnu.org/licenses/>.
+#
+"""Tests for parsing Overture data."""
+
+import struct
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from osm_rawdata.overture import Overture, datasetFiles
+
+
+def overture_batch():
+    """A small batch using the Overture schema."""
+    point = b"\x01" + struct.pack("<Idd", 1, 85.3, 27.7)
+    source = pa.struct(
+        [
+            ("property", pa.string()),
+            ("dataset", pa.string()),
+            ("recordId", pa.string()),
+            ("confidence", pa.float64()),
+        ]
+    )
+    name = pa.struct([("value", pa.string()), ("language", pa.string())])
+    names = pa.struct([("common", pa.struct([("local", pa.list_(name))]))])
+    bbox = pa.struct([("xmin", pa.float64()), ("ymin", pa.float64())])
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(["a", "b", "c"]),
+            pa.array([point, point, point], type=pa.binary()),
+            pa.array([{"xmin": 85.3, "ymin": 27.7}] * 3, type=bbox),
+            pa.array(
+                [
+                    [{"property": "", "dataset": "OpenStreetMap", "recordId": "w1"}],
+                    [{"dataset": "Esri", "confidence": 0.9}],
+                    [],
+                ],
+                type=pa.list_(source),
+            ),
+            pa.array(
+                [
+                    {"common": {"local": [{"value": "Kathmandu", "language": "ne"}]}},
+                    None,
+                    {"common": {"local": []}},
+                ],
+                type=names,
+            ),
+            pa.array([["school"], None, ["hospital", "clinic"]]),
+        ],
+        names=["id", "geometry", "bbox", "sources", "names", "categories"],
+    )
+
+
+def test_parse_batch():
+    """Test the batch parser produces the same tags as parse()."""
+    batch = overture_batch()
+    overture = Overture()
+    tags = overture.parseBatch(batch)
+    assert tags[0] == {
+        "property": "",
+        "dataset": "OpenStreetMap",
+        "recordId": "w1",
+        "value": "Kathmandu",
+        "language": "ne",
+        "categories": "school",
+    }
+    assert tags[1] == {"dataset": "Esri", "confidence": 0.9}
+    assert tags[2] == {"categories": "hospital"}
+
+    # Rows that parse() can handle should match exactly
+    frame = batch.to_pandas()
+    for index in range(0, 2):
+        assert overture.parse(frame.loc[index])["properties"] == tags[index]
+
+    table = overture.parseBatch(pa.Table.from_batches([batch]), table=True)
+    assert table.num_rows == 3
+    assert table.column("dataset").to_pylist() == ["OpenStreetMap", "Esri", None]
+
+
+def test_dataset_files(tmp_path):
+    """Test the files in a hive partitioned dataset are found."""
+    table = pa.Table.from_batches([overture_batch()])
+    for part in ("theme=buildings/type=building", "theme=places/type=place"):
+        directory = tmp_path / part
+        directory.mkdir(parents=True)
+        pq.write_table(table, directory / "part-00000.parquet")
+
+    files = datasetFiles(str(tmp_path))
+    assert len(files) == 2
+    assert files[0].endswith("theme=buildings/type=building/part-00000.parquet")
+    assert datasetFiles(str(tmp_path / "theme=places" / "*" / "*.parquet")) == files[1:]
+    assert datasetFiles(str(tmp_path / "missing" / "*.parquet")) == []
+
+
+def test_filter(tmp_path):
+    """Test the AOI and excluded datasets are filtered before parsing."""
+    point = b"\x01" + struct.pack("<Idd", 1, 85.3, 27.7)
+    fields = [(name, pa.float64()) for name in ("xmin", "ymin", "xmax", "ymax")]
+    source = pa.struct([("dataset", pa.string())])
+    batch = pa.RecordBatch.from_arrays(
+        [
+            pa.array(["a", "b", "c"]),
+            pa.array([point, point, point], type=pa.binary()),
+            pa.array(
+                [
+                    {"xmin": 85.3, "ymin": 27.7, "xmax": 85.3, "ymax": 27.7},
+                    {"xmin": 85.3, "ymin": 27.7, "xmax": 85.3, "ymax": 27.7},
+                    {"xmin": -74.0, "ymin": 40.7, "xmax": -74.0, "ymax": 40.7},
+                ],
+                type=pa.struct(fields),
+            ),
+            pa.array(
+                [[{"dataset": "OpenStreetMap"}], [{"dataset": "Esri"}], []],
+                type=pa.list_(source),
+            ),
+        ],
+        names=["id", "geometry", "bbox", "sources"],
+    )
+    overture = Overture(aoi=(85.0, 27.0, 86.0, 28.0), exclude=["OpenStreetMap"])
+    assert overture.filter(batch).column("id").to_pylist() == ["b"]
+    assert Overture().filter(batch).num_rows == 3
+
+    # Each row is in its own row group, only the first two overlap the AOI
+    infile = tmp_path / "data.parquet"
+    pq.write_table(pa.Table.from_batches([batch]), infile, row_group_size=1)
+    overture = Overture(str(infile), (85.0, 27.0, 86.0, 28.0), ["OpenStreetMap"])
+    assert overture.matchingGroups() == [0, 1]
+    rows = [batch.num_rows for batch in overture.iterBatches()]
+    assert rows == [0, 1]
+    # The rows are counted the same way without reading the whole row group
+    assert [overture.countRows(group) for group in range(0, 3)] == [0, 1, 0]
+    assert Overture(str(infile)).countRows(2) == 1
+
+
+def test_centres():
+    """Test the bbox centres use the field names of older releases."""
+    bbox = pa.struct(
+        [(name, pa.float64()) for name in ("minx", "miny", "maxx", "maxy")]
+    )
+    data = pa.RecordBatch.from_arrays(
+        [pa.array([{"minx": 85.0, "miny": 27.0, "maxx": 86.0, "maxy": 28.0}], bbox)],
+        names=["bbox"],
+    )
+    x, y = Overture.centres(data)
+    assert list(x) == [85.5]
+    assert list(y) == [27.5]
+
+    # Without a complete bbox the geometries are decoded
+    x, y = Overture.centres(overture_batch())
+    assert list(x) == [85.3] * 3
+    assert list(y) == [27.7] * 3
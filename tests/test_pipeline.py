@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2025 Humanitarian OpenStreetMap Team
+#
+# This file is part of osm_rawdata.
+#
+#     This is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     Underpass is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with osm_rawdata.  If not, see <https:#www.gnu.org/licenses/>.
+#
+"""Tests for the import pipeline."""
+
+import operator
+
+import pytest
+
+from osm_rawdata.pipeline import Pipeline
+
+
+def odd(item: int, scale: int):
+    """Drop the even items, and scale the odd ones."""
+    if item % 2 == 0:
+        return None
+    return item * scale
+
+
+def test_stages():
+    """Test the items go through each stage, with the worker arguments."""
+    pipeline = Pipeline(depth=1)
+    pipeline.addStage(operator.neg, 4)
+    pipeline.addStage(odd, 2, args=[(10,), (10,)])
+    result = pipeline.run(range(0, 100))
+    assert sorted(result) == [item * -10 for item in range(99, 0, -2)]
+    assert pipeline.stages[0]["items"] == 100
+    assert pipeline.stages[1]["items"] == 100
+
+    pipeline = Pipeline()
+    pipeline.addStage(operator.neg, 2, processes=True)
+    assert sum(pipeline.run(range(0, 100))) == -4950
+
+
+def test_errors():
+    """Test an error in a stage or the reader stops the pipeline."""
+
+    def fail(item: int):
+        if item == 50:
+            raise ValueError("bad item")
+        return item
+
+    pipeline = Pipeline(depth=1).addStage(fail, 2).addStage(operator.neg)
+    with pytest.raises(ValueError):
+        pipeline.run(range(0, 100000))
+    assert pipeline.stages[0]["items"] < 100000
+
+    def read():
+        yield 1
+        raise OSError("bad input")
+
+    with pytest.raises(OSError):
+        Pipeline().addStage(operator.neg).run(read())
@@ -29,7 +29,7 @@ import requests
 
 import osm_rawdata as rw
 from osm_rawdata.config import QueryConfig
-from osm_rawdata.postgres import PostgresClient
+from osm_rawdata.postgres import PostgresClient, deltaDecode, deltaEncode, parseRefs
 
 log = logging.getLogger(__name__)
 
@@ -89,6 +89,20 @@ def test_parse_reparse_json():
     assert parsed_config == reparsed_config
 
 
+def test_refs():
+    """Test the refs of a way are returned as integers, and delta encoded."""
+    refs = [4410513941, 4410513942, 4410513944, 3203957020, 4410513941]
+    assert parseRefs(refs) == refs
+    assert parseRefs("{4410513941,4410513942,4410513944,3203957020,4410513941}") == refs
+    assert parseRefs("{}") == []
+    assert parseRefs(None) == []
+
+    deltas = deltaEncode(refs)
+    assert deltas == [4410513941, 1, 2, -1206556924, 1206556921]
+    assert deltaDecode(deltas) == refs
+    assert deltaEncode([]) == []
+
+
 # FIXME enable test once all_geometry parsing is fixed
 # def test_all_geometry():
 #     """Test using the all_geometry flag."""